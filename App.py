@@ -1,33 +1,27 @@
+import os
 import sys
+import time
+import hashlib
+import queue
+import threading
 import numpy as np
 import pandas as pd
 import streamlit as st
 
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-
 from Schelling import Schelling as SchellingModel
+from Schelling import ENGINES as SCHELLING_ENGINES
 from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+from GridLoader import CHUNK_SIZE, open_grid, convert_grid_to_char_grid
+from Checkpoint import get_checkpoint_data, write_checkpoint, load_checkpoint
+from Metrics import IterationMetrics
+from Plots import create_simulation_figure, update_simulation_figure
 
-def count_char(tract_data, char_to_count):
-    # Counts specific char from each tract of char sequence obtained via get_splitted_data function
-    char_count = 0
-    for sub_array in tract_data:
-        char_count += np.count_nonzero(sub_array == char_to_count)
-    
-    return char_count
-
-def validate_data_for_invalid_chars(raw_input_data):
-    # Validates the input data if there are invalid characters.
-    total_population = int(raw_input_data.shape[0] * raw_input_data.shape[1])
+# Maximum number of input files, tract sizes, etc. whose results are kept by each cached function.
+# The least recently used result is evicted first.
+CACHE_MAX_ENTRIES = 8
 
-    # Only X, O and empty/null characters sequence are allowed
-    X_char_count = count_char(raw_input_data.values, 'X')
-    O_char_count = count_char(raw_input_data.values, 'O')
-    empty_char_count = count_char(raw_input_data.values, '')
-
-    # Returns false if there are characters other than accepted character sequence
-    return total_population == (X_char_count + O_char_count + empty_char_count)
+# Minimum number of seconds between two checkpoints of a running simulation. The last iteration is always saved.
+CHECKPOINT_INTERVAL = 10.
 
 def validate_row_column_inputs(raw_input_data, input_row, input_column):
     # Validates the input row and colums can successfully split the Data Grid into possible tracts for Index of Dissimilarity calculation
@@ -42,35 +36,209 @@ def validate_row_column_inputs(raw_input_data, input_row, input_column):
 
     return [True, "SUCCESS"]
 
-def convert_char_seq_to_numeric_grid(raw_input_data):
-    # Converts char sequence to numeric equivalent prior to processing. X is 1, O is -1 and empty/null to O
-    # Raw input data should be cleaned and converted to numeric value prior processing
-    converted_input_data = raw_input_data.replace('', 0).replace('X', 1).replace('O', -1)
-
-    return converted_input_data
-
-def convert_numeric_grid_to_char_seq_grid(numeric_grid):
-    # Converts numeric sequence to char equivalent as the final output for display. 1 is X, -1 is O and 0 to empty/null
-    raw_input_dataframe = pd.DataFrame(numeric_grid)
-    converted_output_data = raw_input_dataframe.replace(0, '').replace(1, 'X').replace(-1, 'O')
-
-    return converted_output_data
+# Cached functions. Streamlit reruns main for every widget change, so everything derived from the input data grid is
+# cached by the hash of the input file content (parameters starting with _ are not hashed by Streamlit).
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def get_file_hash(input_file_path, modified_time, file_size):
+    # Hashes the content of the input file. It is only read again when its modification time or size changes.
+    file_hash = hashlib.sha256()
+    with open(input_file_path, 'rb') as input_file:
+        for data in iter(lambda: input_file.read(CHUNK_SIZE), b''):
+            file_hash.update(data)
+
+    return file_hash.hexdigest()
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def load_input_grid(input_file_path, file_hash):
+    # Loads and validates the input data grid once per file content. All reruns and sessions share the same grid,
+    # so it is read-only and the Schelling simulation works on a copy.
+    input_grid, column_names = open_grid(input_file_path, mmap_mode='r')
+    input_grid.flags.writeable = False
+
+    return [input_grid, column_names]
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def get_char_grid(file_hash, _input_grid):
+    # Gets the X, O and blank cells of the input data grid for display
+    return convert_grid_to_char_grid(_input_grid).values
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def get_dissimilarity_model(file_hash, _input_grid):
+    # Gets the Dissimilarity model of the input data grid, its totals and prefix sums are shared by all tract sizes
+    return DissimilaritySegregationModel(_input_grid)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def calculate_dissimilarity_index(file_hash, _input_grid, input_row, input_col):
+    # Calculates D and the partial index of every tract for one tract size
+    return get_dissimilarity_model(file_hash, _input_grid).calculate_dissimilarity_index(input_row, input_col)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def get_multiscale_dissimilarity(file_hash, _input_grid):
+    # Calculates D for every tract size that splits the data grid evenly
+    return get_dissimilarity_model(file_hash, _input_grid).get_multiscale_dissimilarity()
+
+def get_schelling_state(file_hash, input_grid, similarity_threshold, engine):
+    # Gets the Schelling model of the session with the stop message and the best data grid of its last simulation.
+    # The state is kept across reruns while the input file, the similarity threshold and the engine stay the same,
+    # so other widget changes neither count all neighborhoods again nor lose the result of the simulation.
+    schelling_key = (file_hash, similarity_threshold, engine)
+    if st.session_state.get('schelling_key') != schelling_key:
+        # The compiled engine is warmed up once per process so a rerun of the app does not compile the kernel again
+        st.session_state['schelling_key'] = schelling_key
+        st.session_state['schelling_state'] = [SchellingModel(input_grid.copy(), similarity_threshold, 3, engine, warm_up=True), None,
+            np.array([])]
+
+    return st.session_state['schelling_state']
+
+def show_iteration_metrics(metrics_chart, metrics_records):
+    # Shows the number of unsatisfied agents and of agents that moved in every iteration, next to the mean similarity ratio
+    if metrics_records:
+        metrics_dataframe = pd.DataFrame(metrics_records).set_index('iteration')
+        metrics_chart.line_chart(metrics_dataframe[['unsatisfied_count', 'moves_count']])
+
+# Class that writes the checkpoints of a simulation on its own thread
+#
+# Compressing the data grid takes about as long as an iteration on large data grids, so the simulation thread only copies
+# the state to save (see Checkpoint.get_checkpoint_data) and goes on, at most once every min_interval seconds so that the
+# writer does not compete with the simulation for the CPU. Only the latest copy waits to be written: when the writer falls
+# behind, older copies are replaced and skipped. close writes the copy still waiting and stops the thread.
+class CheckpointWriter(threading.Thread):
+
+    def __init__(self, checkpoint_file_path, min_interval=CHECKPOINT_INTERVAL):
+        super().__init__(daemon=True)
+        self.checkpoint_file_path = checkpoint_file_path
+        self.min_interval = min_interval
+        # The first checkpoint is put min_interval seconds after the writer is created
+        self.last_put_time = time.perf_counter()
+        self.checkpoint_data = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.error = None
+
+    def put(self, schelling, force=False):
+        # Copies the current state of the model as the next checkpoint to write, unless the last one was put less than
+        # min_interval seconds ago and force is False
+        now = time.perf_counter()
+        if not force and now - self.last_put_time < self.min_interval:
+            return
+
+        self.last_put_time = now
+        checkpoint_data = get_checkpoint_data(schelling)
+        with self.condition:
+            self.checkpoint_data = checkpoint_data
+            self.condition.notify()
+
+    def close(self):
+        # Writes the last checkpoint put and waits for the thread to stop
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.checkpoint_data is None and not self.closed:
+                    self.condition.wait()
+                if self.checkpoint_data is None:
+                    return
+                checkpoint_data, self.checkpoint_data = self.checkpoint_data, None
+
+            try:
+                write_checkpoint(checkpoint_data, self.checkpoint_file_path)
+            except Exception as error:
+                # Reported by the simulation thread once it is done
+                self.error = error
+
+# Class that runs a Schelling simulation on a background thread
+#
+# Streamlit elements can only be updated from the script thread, so the simulation thread only puts frames (iterations run,
+# copy of the data grid, of the similarity history and of the iteration metrics) in a queue that the script thread renders.
+# A frame is put every render_every iterations, at most max_frame_rate times per second (no limit with 0), and after the
+# last iteration, so the rendering never slows the simulation down. Checkpoints are written by a CheckpointWriter, at most
+# once every checkpoint_interval seconds and after the last iteration, so saving them does not slow the simulation down either.
+class SimulationThread(threading.Thread):
+
+    def __init__(self, schelling, n_iterations, stop_tolerance, render_every=1, max_frame_rate=0., checkpoint_file_path=None,
+            checkpoint_interval=CHECKPOINT_INTERVAL):
+        super().__init__(daemon=True)
+        self.schelling = schelling
+        self.n_iterations = n_iterations
+        self.stop_tolerance = stop_tolerance
+        self.render_every = max(1, int(render_every))
+        self.min_frame_interval = 1. / max_frame_rate if max_frame_rate > 0 else 0.
+        self.checkpoint_writer = CheckpointWriter(checkpoint_file_path, checkpoint_interval) if checkpoint_file_path else None
+
+        self.frames = queue.Queue()
+        self.stop_requested = threading.Event()
+        self.last_frame_time = 0.
+        self.stop_reason = None
+        self.error = None
+
+        # Data grid with the largest mean similarity ratio of the simulation
+        self.highest_similarity_ratio = schelling.get_average_similarity_ratio() if schelling.rated_agents_count else 0.
+        self.best_data_grid = np.array([])
+
+    def run(self):
+        # Runs the simulation until it is stable, until n_iterations iterations have run or until it is stopped
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.start()
+        try:
+            self.stop_reason = self.schelling.run_until_stable(self.n_iterations, self.stop_tolerance, callback=self.end_iteration)[1]
+        except InterruptedError:
+            self.stop_reason = 'STOPPED'
+        except Exception as error:
+            # Raised again by the script thread, which can report it
+            self.error = error
+        finally:
+            self.put_frame(is_last_frame=True)
+            if self.checkpoint_writer is not None:
+                # The checkpoint of the last iteration is written before the simulation is reported as done
+                self.checkpoint_writer.close()
+                self.error = self.error or self.checkpoint_writer.error
+
+    def end_iteration(self, schelling, moves_count):
+        # Called after every iteration of the Schelling Model Simulation
+        if self.stop_requested.is_set():
+            raise InterruptedError('The simulation was stopped.')
+
+        latest_similarity_ratio = schelling.get_average_similarity_ratio()
+        if self.highest_similarity_ratio < latest_similarity_ratio:
+            self.highest_similarity_ratio = latest_similarity_ratio
+            self.best_data_grid = schelling.data_grid.copy()
+
+        if schelling.iterations % self.render_every == 0 and time.perf_counter() - self.last_frame_time >= self.min_frame_interval:
+            self.put_frame()
+
+    def put_frame(self, is_last_frame=False):
+        # Puts the current state of the simulation in the frames queue and, when it is time for a checkpoint, a copy of it in
+        # the checkpoint writer. A rerun of the app stops the simulation, it can be resumed from the checkpoint of its last iteration.
+        self.last_frame_time = time.perf_counter()
+        metrics_records = list(self.schelling.metrics.records) if self.schelling.metrics is not None else []
+        self.frames.put([self.schelling.iterations, self.schelling.data_grid.copy(), list(self.schelling.similarity_history), metrics_records])
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.put(self.schelling, force=is_last_frame)
 
 def main():
     st.sidebar.subheader("Input Data")
-    input_file_path = st.sidebar.text_input('CSV file path' , 'Input_data.csv')
+    input_file_path = st.sidebar.text_input('CSV or .npy file path' , 'Input_data.csv')
     st.sidebar.subheader("")
 
     try:
-        # Gets the raw input data from the input csv file path from user
-        raw_input_data = pd.read_csv(input_file_path).fillna('')
+        # Gets the input data grid from the input csv (or memory-mapped .npy) file path from user as a compact numeric grid
+        # (X is 1, O is -1 and empty/null is 0). The characters are validated while the file is parsed, input_grid is None if
+        # there are invalid characters. The grid is only loaded again when the content of the file changes.
+        input_file_stat = os.stat(input_file_path)
+        file_hash = get_file_hash(input_file_path, input_file_stat.st_mtime, input_file_stat.st_size)
+        input_grid, column_names = load_input_grid(input_file_path, file_hash)
+    except ValueError:
+        input_grid = None
     except:
         # When the path of the csv file is invalid, system exits and throws an error message
         sys.exit('Invalid path or csv file! Please input valid path or csv file.')
 
-    if (validate_data_for_invalid_chars(raw_input_data)):
-        converted_input_data = convert_char_seq_to_numeric_grid(raw_input_data)
-        population_size = int(converted_input_data.shape[0] * converted_input_data.shape[1])
+    if input_grid is not None:
+        population_size = int(input_grid.shape[0] * input_grid.shape[1])
 
         # Streamlit Apps
         #####################################
@@ -81,26 +249,24 @@ def main():
         input_row = st.sidebar.number_input("Number of Rows per Tract", 1)
         input_col = st.sidebar.number_input("Number of Columns per Tract", 1)
         st.header('Original Data Grid')
-        st.dataframe(raw_input_data.values);
+        st.dataframe(get_char_grid(file_hash, input_grid));
 
         if st.sidebar.button('Calculate Index of Dissimilarity'):
-            is_valid_row_col_input = validate_row_column_inputs(raw_input_data, input_row, input_col)
+            is_valid_row_col_input = validate_row_column_inputs(input_grid, input_row, input_col)
             if is_valid_row_col_input[0]:
-                dissimilarity = DissimilaritySegregationModel(raw_input_data)
+                dissimilarity = get_dissimilarity_model(file_hash, input_grid)
                 total_number_of_tracts = int(population_size/(input_row*input_col))
-                partial_indices = []
 
+                # D and the partial index of every tract are calculated at once over the whole data grid
+                D, partial_indices = calculate_dissimilarity_index(file_hash, input_grid, input_row, input_col)
                 data_tracts = dissimilarity.get_splitted_data(input_row, input_col)
                 tract_number = 1
-                for data_per_tract in data_tracts:
-                    partial_index = dissimilarity.calculate_partial_index(data_per_tract)
-                    partial_indices.append(partial_index)
-
+                for data_per_tract, partial_index in zip(data_tracts, partial_indices):
                     st.text('Data Grid for Tract ' + str(tract_number) + ' with Partial Index: ' + str(round(partial_index, 2)))
-                    st.dataframe(data_per_tract)
+                    st.dataframe(convert_grid_to_char_grid(data_per_tract).values)
                     tract_number += 1
 
-                D = round(0.5*sum(partial_indices), 2)
+                D = round(D, 2)
                 st.sidebar.subheader("Index of Dissimilarity: " + str(D))
 
             else:
@@ -110,6 +276,12 @@ def main():
                     st.error("Cannot split the data grid with equal number of characterss per tract/splice based on the input row or column.")
                 st.error("Please enter valid data.")
 
+        if st.sidebar.button('Calculate Index of Dissimilarity for All Tract Sizes'):
+            # D for every tract size that splits the data grid evenly, read from prefix sums of X and O
+            multiscale_dissimilarity = get_multiscale_dissimilarity(file_hash, input_grid)
+            st.header('Index of Dissimilarity by Tract Size')
+            st.dataframe(multiscale_dissimilarity)
+
         ##################################
         # Schelling's Segregartion Model #
         ##################################
@@ -118,75 +290,97 @@ def main():
         st.sidebar.subheader("Schelling's Segregation Model Inputs")
         similarity_threshold = st.sidebar.slider("Similarity Threshold", 0., 1., .4)
         n_iterations = st.sidebar.number_input("Number of Iterations", 20)
-
-        schelling = SchellingModel(converted_input_data, similarity_threshold, 3)
-        mean_similarity_ratio = []
-        mean_similarity_ratio.append(schelling.get_average_similarity_ratio())
-
-        # Plot the graphs at initial stage
-        plt.style.use("ggplot")
-        plt.figure(figsize=(8, 4))
-
-        # Left hand side graph with Schelling simulation plot
-        cmap = ListedColormap(['royalblue', 'white', 'red'])
-        plt.subplot(121)
-        plt.axis('off')
-        plt.title("X - Red \nO - Blue", fontsize=10)
-        plt.pcolor(schelling.data_grid, cmap=cmap, edgecolors='w', linewidths=1)
-        plt.gca().invert_yaxis()
-
-        # Right hand side graph with Mean Similarity Ratio graph
-        plt.subplot(122)
-        plt.xlabel("Iterations")
-        plt.xlim([0, n_iterations])
-        plt.ylim([0.4, 1])
-        plt.title("Mean Similarity Ratio", fontsize=12)
-        plt.text(1, 0.95, "Similarity Ratio: %.4f" % schelling.get_average_similarity_ratio(), fontsize=10)
-
-        data_grid_plot = st.pyplot(plt)
-        progress_bar = st.progress(0)
-
-        new_satisfied_data_grid = np.array([])
-        if st.sidebar.button('Run Schelling Simulation'):
-            current_highest_mean_sim_ratio = schelling.get_average_similarity_ratio();
-            for i in range(n_iterations):
-                # Starts running the Schelling Model Simulation
-                schelling.run_simulation()
-                latest_sim_ratio = schelling.get_average_similarity_ratio()
-                if current_highest_mean_sim_ratio < latest_sim_ratio:
-                    current_highest_mean_sim_ratio = latest_sim_ratio
-                    new_satisfied_data_grid = schelling.data_grid
-                mean_similarity_ratio.append(schelling.get_average_similarity_ratio())
-                plt.figure(figsize=(8, 4))
-            
-                # Plotting the current Data Grid
-                plt.subplot(121)
-                plt.axis('off')
-                plt.title("X - Red \nO - Blue", fontsize=10)
-                plt.pcolor(schelling.data_grid, cmap=cmap, edgecolors='w', linewidths=1)
-                plt.gca().invert_yaxis()
-
-                plt.subplot(122)
-                plt.xlabel("Iterations")
-                plt.xlim([0, n_iterations])
-                plt.ylim([0.4, 1])
-                plt.title("Mean Similarity Ratio", fontsize=15)
-                plt.plot(range(1, len(mean_similarity_ratio)+1), mean_similarity_ratio)
-                plt.text(1, 0.95, "Similarity Ratio: %.4f" % schelling.get_average_similarity_ratio(), fontsize=10)
-
-                data_grid_plot.pyplot(plt)
-                plt.close("all")
-                progress_bar.progress((i+1.)/n_iterations)
+        engine = st.sidebar.selectbox("Simulation Engine", SCHELLING_ENGINES)
+        stop_tolerance = st.sidebar.number_input("Stop Tolerance", 0., 1., 0., format="%.4f")
+        checkpoint_file_path = st.sidebar.text_input("Checkpoint File Path", "Schelling_checkpoint.npz")
+        render_every = st.sidebar.number_input("Render Every N Iterations", 1)
+        max_frame_rate = st.sidebar.number_input("Maximum Frames per Second", 0., 60., 10.)
+
+        # Model of the session, at the initial stage or where its last simulation stopped
+        schelling, stop_message, new_satisfied_data_grid = get_schelling_state(file_hash, input_grid, similarity_threshold, engine)
+
+        # Plot the graphs of the model. The same figure is updated after every rendered iteration.
+        simulation_figure = create_simulation_figure(n_iterations)
+        update_simulation_figure(simulation_figure, schelling.data_grid, schelling.similarity_history)
+        data_grid_plot = st.pyplot(simulation_figure[0])
+        metrics_chart = st.empty()
+        progress_bar = st.progress(min(schelling.iterations/n_iterations, 1.))
+        if schelling.metrics is not None:
+            show_iteration_metrics(metrics_chart, schelling.metrics.records)
+
+        run_simulation = st.sidebar.button('Run Schelling Simulation')
+        resume_simulation = st.sidebar.button('Resume Schelling Simulation from Checkpoint')
+        if run_simulation and schelling.iterations != 0:
+            # A new simulation starts from the input data grid, the model of the session is only reused when it has not run yet
+            schelling = SchellingModel(input_grid.copy(), similarity_threshold, 3, engine, warm_up=True)
+        if resume_simulation:
+            try:
+                # Continues the run saved in the checkpoint file with its data grid, random state, iterations and similarity history
+                schelling = load_checkpoint(checkpoint_file_path, engine, warm_up=True)
+            except OSError:
+                st.error("No checkpoint found in " + checkpoint_file_path + ". Please run the simulation first.")
+                resume_simulation = False
+
+        if run_simulation or resume_simulation:
+            # Counters and timings of every iteration of the simulation
+            schelling.metrics = IterationMetrics()
+
+            # Starts running the Schelling Model Simulation on a background thread, it stops early once no agent moves anymore
+            # or when the moves or the mean similarity ratio change less than the stop tolerance.
+            # A resumed simulation only runs the iterations that are left.
+            simulation = SimulationThread(schelling, n_iterations - schelling.iterations, stop_tolerance, render_every,
+                max_frame_rate, checkpoint_file_path)
+            simulation.start()
+            try:
+                # Renders the frames of the simulation as they come. When rendering falls behind, only the latest frame is shown.
+                while simulation.is_alive() or not simulation.frames.empty():
+                    try:
+                        frame = simulation.frames.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    while not simulation.frames.empty():
+                        frame = simulation.frames.get_nowait()
+
+                    iterations, data_grid, similarity_history, metrics_records = frame
+                    update_simulation_figure(simulation_figure, data_grid, similarity_history)
+                    data_grid_plot.pyplot(simulation_figure[0])
+                    show_iteration_metrics(metrics_chart, metrics_records)
+                    progress_bar.progress(min(iterations/n_iterations, 1.))
+            finally:
+                # A rerun of the app interrupts this loop, the simulation then stops after its current iteration
+                simulation.stop_requested.set()
+                simulation.join()
+
+            if simulation.error is not None:
+                raise simulation.error
+
+            new_satisfied_data_grid = simulation.best_data_grid
+            progress_bar.progress(1.)
+            stop_message = "Simulation stopped after " + str(schelling.iterations) + " iterations: " + simulation.stop_reason
+            st.session_state['schelling_state'] = [schelling, stop_message, new_satisfied_data_grid]
+
+        if stop_message is not None:
+            st.sidebar.subheader(stop_message)
+
+        if schelling.metrics is not None and schelling.metrics.records:
+            # Counters and time spent in every phase of every iteration, with CSV and JSON exports
+            metrics_dataframe = schelling.metrics.get_dataframe()
+            st.header("Iteration Metrics")
+            st.dataframe(metrics_dataframe)
+            st.download_button("Download Iteration Metrics (CSV)", metrics_dataframe.to_csv(index=False), "Schelling_metrics.csv", "text/csv")
+            st.download_button("Download Iteration Metrics (JSON)", metrics_dataframe.to_json(orient='records'),
+                "Schelling_metrics.json", "application/json")
 
         if new_satisfied_data_grid.size != 0:
             # Display the new data grid with satisfied neighboring characters
-            new_data_grid_df = convert_numeric_grid_to_char_seq_grid(new_satisfied_data_grid)
+            new_data_grid_df = convert_grid_to_char_grid(new_satisfied_data_grid, column_names)
             st.header("New Data Grid with Satisfied Neighboring Characters")
             st.dataframe(new_data_grid_df)
 
-            # Save output to Output.csv file
-            pd.DataFrame(new_data_grid_df).to_csv('Output_data.csv', index=False)
-            st.warning("Output_data.csv file has been created.")
+            # Save output to Output.csv file, once after the simulation
+            if run_simulation or resume_simulation:
+                pd.DataFrame(new_data_grid_df).to_csv('Output_data.csv', index=False)
+                st.warning("Output_data.csv file has been created.")
 
     else:
         st.error('ERROR: Invalid characters in the data. Please check dataset from Input_data.csv and retry.')
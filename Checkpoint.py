@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+
+from Schelling import Schelling as SchellingModel
+
+def get_rng_state(rng):
+    # Gets the state of a numpy Generator as a JSON string. The state of PCG64 holds 128-bit integers, which JSON keeps exact.
+    return json.dumps(rng.bit_generator.state)
+
+def create_rng(rng_state):
+    # Creates a numpy Generator that continues exactly from a state saved by get_rng_state
+    state = json.loads(rng_state)
+    bit_generator = getattr(np.random, state['bit_generator'])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+def get_checkpoint_data(schelling):
+    # Gets copies of everything needed to resume a Schelling simulation: the data grid, the RNG state, the iterations run,
+    # the similarity history and the parameters of the model. The order of the empty cells index is copied too, since the
+    # next moves depend on it. The copies can be written by write_checkpoint while the simulation goes on.
+    empty_cells = schelling.empty_cells.get_cells() if schelling.engine != 'tiled' else np.zeros(0, dtype=np.int64)
+    return {'data_grid': np.array(schelling.data_grid), 'empty_cells': empty_cells.copy(), 'rng_state': get_rng_state(schelling.rng),
+        'iterations': schelling.iterations, 'similarity_history': np.array(schelling.similarity_history, dtype=np.float64),
+        'similarity_threshold': schelling.similarity_threshold, 'neighbors_count': schelling.neighbors_count, 'engine': schelling.engine}
+
+def write_checkpoint(checkpoint_data, checkpoint_file_path):
+    # Writes the data of get_checkpoint_data to a compressed .npz file
+    np.savez_compressed(checkpoint_file_path, **checkpoint_data)
+
+def save_checkpoint(schelling, checkpoint_file_path):
+    # Saves everything needed to resume a Schelling simulation to a compressed .npz file
+    write_checkpoint(get_checkpoint_data(schelling), checkpoint_file_path)
+
+def load_checkpoint(checkpoint_file_path, engine=None, warm_up=False):
+    # Loads a Schelling model from a checkpoint saved by save_checkpoint, ready to run the next iteration.
+    # A run resumed with the engine it was saved with gives the same moves as if it had never stopped.
+    # Raises OSError for an invalid path.
+    with np.load(checkpoint_file_path) as checkpoint:
+        engine = engine or str(checkpoint['engine'])
+        schelling = SchellingModel(checkpoint['data_grid'], float(checkpoint['similarity_threshold']),
+            int(checkpoint['neighbors_count']), engine, warm_up, seed=create_rng(str(checkpoint['rng_state'])))
+
+        if engine != 'tiled' and checkpoint['empty_cells'].size == len(schelling.empty_cells):
+            schelling.empty_cells.reset(schelling.empty_cells.get_cells().copy(), checkpoint['empty_cells'])
+
+        schelling.iterations = int(checkpoint['iterations'])
+        schelling.similarity_history = checkpoint['similarity_history'].tolist()
+
+    return schelling
+
+# Class that writes the trajectory of a Schelling simulation to an append-only file
+#
+# The file holds the data grid before the first iteration followed by one record per iteration with the cells that
+# changed and their new values, all written one after another in the .npy format. Records are appended and flushed after
+# every iteration, so a run that is stopped keeps its trajectory up to its last iteration. The record method can be used
+# as the callback of Schelling.run_until_stable, or be called after every run_simulation.
+class TrajectoryLog:
+
+    def __init__(self, trajectory_file_path, schelling):
+        # A model that has not run yet starts a new file from its data grid. An existing file with a model resumed from a
+        # checkpoint is replayed up to the iteration of the model, which must give its data grid: the records after that
+        # iteration are then dropped before new ones are appended. Raises ValueError if the file is not the trajectory of the model.
+        self.trajectory_file_path = trajectory_file_path
+        self.previous_grid = np.array(schelling.data_grid)
+        if schelling.iterations == 0 or not os.path.exists(trajectory_file_path):
+            with open(trajectory_file_path, 'wb') as trajectory_file:
+                np.save(trajectory_file, self.previous_grid)
+            return
+
+        with open(trajectory_file_path, 'r+b') as trajectory_file:
+            data_grid = np.load(trajectory_file)
+            for iteration in range(schelling.iterations):
+                record = read_trajectory_record(trajectory_file)
+                if record is None:
+                    raise ValueError('The trajectory file only has %d of the %d iterations of the model.' % (iteration, schelling.iterations))
+                changed_cells, changed_values = record
+                data_grid.flat[changed_cells] = changed_values
+
+            if data_grid.shape != self.previous_grid.shape or (data_grid != self.previous_grid).any():
+                raise ValueError('The trajectory file does not give the data grid of the model at iteration %d.' % schelling.iterations)
+
+            trajectory_file.truncate(trajectory_file.tell())
+
+    def record(self, schelling, moves_count=None):
+        # Appends the cells that changed during the last iteration and their new values
+        changed_cells = np.flatnonzero(self.previous_grid != schelling.data_grid)
+        changed_values = schelling.data_grid.flat[changed_cells]
+        with open(self.trajectory_file_path, 'ab') as trajectory_file:
+            np.save(trajectory_file, changed_cells)
+            np.save(trajectory_file, changed_values)
+
+        self.previous_grid.flat[changed_cells] = changed_values
+
+def read_trajectory_record(trajectory_file):
+    # Reads the changed cells and their new values of the next iteration, or returns None at the end of the file
+    if trajectory_file.tell() == os.fstat(trajectory_file.fileno()).st_size:
+        return None
+
+    return [np.load(trajectory_file), np.load(trajectory_file)]
+
+def replay_trajectory(trajectory_file_path):
+    # Replays a trajectory written by TrajectoryLog without running the simulation again.
+    # Yields the iteration number and the data grid before the first iteration and after every iteration.
+    # The same data grid is updated in place, copy it to keep it.
+    with open(trajectory_file_path, 'rb') as trajectory_file:
+        data_grid = np.load(trajectory_file)
+        iteration = 0
+        yield [iteration, data_grid]
+
+        record = read_trajectory_record(trajectory_file)
+        while record is not None:
+            changed_cells, changed_values = record
+            data_grid.flat[changed_cells] = changed_values
+            iteration += 1
+            yield [iteration, data_grid]
+            record = read_trajectory_record(trajectory_file)
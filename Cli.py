@@ -0,0 +1,145 @@
+import sys
+import csv
+import json
+import time
+import argparse
+
+from Schelling import Schelling as SchellingModel
+from Schelling import ENGINES as SCHELLING_ENGINES
+from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+from GridLoader import open_grid, save_grid
+from Checkpoint import save_checkpoint, load_checkpoint
+
+# pandas (Metrics) and matplotlib (Plots) are only imported when metrics or a plot are requested, so that a batch run
+# starts fast and uses little memory.
+
+# Formats of the results file. Without a format, it is taken from the extension of the file path (JSON by default).
+OUTPUT_FORMATS = ('json', 'csv')
+
+def get_output_format(output_file_path, output_format=None):
+    # Gets the format of the results file from the format option or from the extension of its path
+    if output_format is not None:
+        return output_format
+
+    return 'csv' if output_file_path is not None and output_file_path.endswith('.csv') else 'json'
+
+def write_results(results, output_file_path=None, output_format=None):
+    # Writes a list of result rows (dicts with the same keys) as JSON or CSV, to the output file or to the standard output
+    output_format = get_output_format(output_file_path, output_format)
+    output_file = open(output_file_path, 'w', newline='') if output_file_path not in (None, '-') else sys.stdout
+    try:
+        if output_format == 'csv':
+            writer = csv.DictWriter(output_file, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            # numpy scalars are written as the Python numbers they hold
+            json.dump(results, output_file, indent=1, default=lambda value: value.item())
+            output_file.write('\n')
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+def validate_tract_size(data_grid, tract_rows, tract_cols):
+    # Exits with an error message if the data grid cannot be split into tracts of tract_rows x tract_cols cells
+    if data_grid.shape[0] % tract_rows != 0 or data_grid.shape[1] % tract_cols != 0:
+        sys.exit('Cannot split the %dx%d data grid into tracts of %d rows and %d columns.' % (data_grid.shape + (tract_rows, tract_cols)))
+
+def run_dissimilarity(data_grid, args):
+    # Calculates the Index of Dissimilarity of the data grid for the given tract size, or for every tract size
+    dissimilarity = DissimilaritySegregationModel(data_grid)
+    if args.all_tract_sizes:
+        return dissimilarity.get_multiscale_dissimilarity().to_dict('records')
+
+    validate_tract_size(data_grid, args.tract_rows, args.tract_cols)
+    D, partial_indices = dissimilarity.calculate_dissimilarity_index(args.tract_rows, args.tract_cols)
+    return [{'tract_rows': args.tract_rows, 'tract_cols': args.tract_cols, 'tracts_count': len(partial_indices), 'dissimilarity_index': D}]
+
+def run_schelling(data_grid, args):
+    # Runs the Schelling simulation until it is stable or until the number of iterations is reached, from the input data
+    # grid or from a checkpoint. Saves the final data grid, the metrics, the checkpoint and the plot when they are requested.
+    metrics = None
+    if args.metrics:
+        from Metrics import IterationMetrics
+        metrics = IterationMetrics()
+
+    if args.resume:
+        try:
+            schelling = load_checkpoint(args.resume, args.engine, warm_up=True)
+        except OSError as error:
+            sys.exit('Invalid checkpoint file! %s' % error)
+        schelling.metrics = metrics
+    else:
+        # A tiled run works on the memory-mapped .npy input itself, the other engines on a copy of the input data grid
+        data_grid = data_grid if args.engine == 'tiled' and args.in_place else data_grid.copy()
+        schelling = SchellingModel(data_grid, args.threshold, args.neighbors, args.engine or 'vectorized', warm_up=True, seed=args.seed,
+            metrics=metrics)
+
+    if args.tract_rows is not None:
+        validate_tract_size(schelling.data_grid, args.tract_rows, args.tract_cols)
+
+    start = time.perf_counter()
+    stop_reason = schelling.run_until_stable(args.iterations - schelling.iterations, args.tolerance, args.patience)[1]
+    seconds = time.perf_counter() - start
+
+    result = {'similarity_threshold': schelling.similarity_threshold, 'neighbors_count': schelling.neighbors_count,
+        'engine': schelling.engine, 'seed': args.seed, 'iterations': schelling.iterations, 'stop_reason': stop_reason,
+        'similarity_ratio': schelling.get_average_similarity_ratio() if schelling.rated_agents_count else None, 'seconds': seconds}
+    if args.tract_rows is not None:
+        # Index of Dissimilarity of the final data grid
+        result['dissimilarity_index'] = DissimilaritySegregationModel(schelling.data_grid).calculate_dissimilarity_index(args.tract_rows, args.tract_cols)[0]
+
+    if args.output_grid:
+        save_grid(schelling.data_grid, args.output_grid, args.column_names)
+    if args.metrics and args.metrics.endswith('.csv'):
+        metrics.to_csv(args.metrics)
+    elif args.metrics:
+        metrics.to_json(args.metrics)
+    if args.checkpoint:
+        save_checkpoint(schelling, args.checkpoint)
+    if args.plot:
+        from Plots import save_simulation_plot
+        save_simulation_plot(schelling, args.iterations, args.plot)
+
+    return [result]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the Index of Dissimilarity or Schelling's segregation model without Streamlit.")
+    parser.add_argument('--input', default='Input_data.csv', help='CSV or int8 .npy file path of the input data grid')
+    parser.add_argument('--output', default=None, help='file path of the results (default: standard output)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=None, help='format of the results (default: from the --output extension, else json)')
+    subparsers = parser.add_subparsers(dest='model', required=True)
+
+    dissimilarity_parser = subparsers.add_parser('dissimilarity', help='calculates the Index of Dissimilarity of the input data grid')
+    dissimilarity_parser.add_argument('--tract-rows', type=int, default=1, help='number of rows per tract')
+    dissimilarity_parser.add_argument('--tract-cols', type=int, default=1, help='number of columns per tract')
+    dissimilarity_parser.add_argument('--all-tract-sizes', action='store_true', help='calculates D for every tract size that splits the data grid evenly')
+
+    schelling_parser = subparsers.add_parser('schelling', help="runs Schelling's segregation model on the input data grid")
+    schelling_parser.add_argument('--threshold', type=float, default=0.4, help='similarity threshold')
+    schelling_parser.add_argument('--neighbors', type=int, default=3, help='neighbors count')
+    schelling_parser.add_argument('--iterations', type=int, default=20, help='maximum number of iterations (resumed runs included)')
+    schelling_parser.add_argument('--tolerance', type=float, default=0., help='stops when the share of agents that moved or the change of the mean similarity ratio stays under it')
+    schelling_parser.add_argument('--patience', type=int, default=1, help='number of iterations in a row under the tolerance before the run stops')
+    schelling_parser.add_argument('--engine', choices=SCHELLING_ENGINES, default=None, help='simulation engine (default: vectorized, or the engine of the resumed checkpoint)')
+    schelling_parser.add_argument('--seed', type=int, default=None, help='random seed')
+    schelling_parser.add_argument('--in-place', action='store_true', help='with the tiled engine, moves the agents in the .npy input file itself')
+    schelling_parser.add_argument('--tract-rows', type=int, default=None, help='number of rows per tract for the Index of Dissimilarity of the final data grid')
+    schelling_parser.add_argument('--tract-cols', type=int, default=1, help='number of columns per tract for the Index of Dissimilarity of the final data grid')
+    schelling_parser.add_argument('--output-grid', default=None, help='CSV or .npy file path of the final data grid')
+    schelling_parser.add_argument('--metrics', default=None, help='CSV or JSON file path of the metrics of every iteration')
+    schelling_parser.add_argument('--checkpoint', default=None, help='.npz file path of the checkpoint saved at the end of the run')
+    schelling_parser.add_argument('--resume', default=None, help='.npz checkpoint file path to resume the run from, instead of the input data grid')
+    schelling_parser.add_argument('--plot', default=None, help='image file path of the final data grid and mean similarity ratio plot')
+    args = parser.parse_args(argv)
+
+    try:
+        data_grid, args.column_names = open_grid(args.input, mmap_mode='r+' if getattr(args, 'in_place', False) else 'r')
+    except (OSError, ValueError) as error:
+        sys.exit('Invalid path or csv file! %s' % error)
+
+    results = run_dissimilarity(data_grid, args) if args.model == 'dissimilarity' else run_schelling(data_grid, args)
+    write_results(results, args.output, args.format)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,152 @@
-import pandas as pd
 import numpy as np
 
+from GridLoader import get_tile_rows
+
 # Class the handles calculation of Index of Dissimilarity for Segration Model
 class Dissimilarity:
 
 	def __init__(self, input_data):
 		self.input_data = input_data
-		self.total_X_count = self.count_char(input_data.values, 'X')
-		self.total_O_count = self.count_char(input_data.values, 'O')
+
+		# Compact int8 data grid. X is 1, O is -1 and empty/null is 0. Grids of X, O and blank characters are converted only once,
+		# int8 grids (including memory-mapped ones) are used as they are and only read tile by tile
+		data_grid = input_data if isinstance(input_data, np.ndarray) else np.asarray(input_data)
+		if data_grid.dtype.kind in 'OUS':
+			self.numeric_grid = (data_grid == 'X').astype(np.int8) - (data_grid == 'O').astype(np.int8)
+		else:
+			self.numeric_grid = data_grid.astype(np.int8, copy=False)
+
+		self.total_X_count = 0
+		self.total_O_count = 0
+		for tile in self.get_tiles():
+			self.total_X_count += np.count_nonzero(tile == 1)
+			self.total_O_count += np.count_nonzero(tile == -1)
+
+	def get_tiles(self, nrows=1, first_row=0, last_row=None):
+		# Yields the rows first_row to last_row of the data grid in bands of whole rows, with a multiple of nrows rows per band,
+		# so that large (memory-mapped) grids are never read into memory at once
+		last_row = self.numeric_grid.shape[0] if last_row is None else last_row
+		tile_rows = max(nrows, get_tile_rows(self.numeric_grid) // nrows * nrows)
+		for tile_first_row in range(first_row, last_row, tile_rows):
+			yield np.asarray(self.numeric_grid[tile_first_row:min(tile_first_row + tile_rows, last_row)])
 
 	def get_splitted_data(self, nrows, ncols):
 		# Splits a matrix/data grid into sub-matrices based on the given number of rows and columns per split/sub-grid
 		r, h = self.input_data.shape
 
-		return (self.input_data.values.reshape(h//nrows, nrows, -1, ncols)
+		return (np.asarray(self.input_data).reshape(r//nrows, nrows, -1, ncols)
 			.swapaxes(1, 2)
 			.reshape(-1, nrows, ncols))
 
+	def calculate_dissimilarity_index(self, nrows, ncols):
+		# Calculates the Index of Dissimilarity (D) and the partial index of every tract at once.
+		# Tracts are in the same order as get_splitted_data. Returns D and the array of partial indices.
+		h = self.numeric_grid.shape[1]
+		x_counts_in_tracts = []
+		o_counts_in_tracts = []
+		for tile in self.get_tiles(nrows):
+			tracts = tile.reshape(tile.shape[0]//nrows, nrows, h//ncols, ncols)
+			x_counts_in_tracts.append(np.count_nonzero(tracts == 1, axis=(1, 3)).ravel())
+			o_counts_in_tracts.append(np.count_nonzero(tracts == -1, axis=(1, 3)).ravel())
+
+		x_counts_in_tracts = np.concatenate(x_counts_in_tracts)
+		o_counts_in_tracts = np.concatenate(o_counts_in_tracts)
+
+		partial_indices = np.abs((x_counts_in_tracts/self.total_X_count) - (o_counts_in_tracts/self.total_O_count))
+		return [0.5*partial_indices.sum(), partial_indices]
+
+	def get_prefix_sum_tables(self):
+		# Gets the 2D prefix sums (summed-area tables) of X and O. They are built on first use and then reused,
+		# so the X and O counts of any rectangle of the data grid can be read in O(1).
+		if not hasattr(self, 'prefix_sum_tables'):
+			r, h = self.numeric_grid.shape
+			table_dtype = np.int32 if self.numeric_grid.size < np.iinfo(np.int32).max else np.int64
+			self.prefix_sum_tables = [np.zeros((r + 1, h + 1), dtype=table_dtype) for char_value in (1, -1)]
+
+			# Built tile by tile, every tile continues from the last row of prefix sums of the previous tile
+			first_row = 0
+			for tile in self.get_tiles():
+				for table, char_value in zip(self.prefix_sum_tables, (1, -1)):
+					tile_table = table[first_row + 1:first_row + tile.shape[0] + 1, 1:]
+					np.cumsum(np.cumsum(tile == char_value, axis=0, dtype=table_dtype), axis=1, out=tile_table)
+					tile_table += table[first_row, 1:]
+				first_row += tile.shape[0]
+
+		return self.prefix_sum_tables
+
+	def count_chars_in_tracts(self, nrows, ncols, row_offset=0, col_offset=0):
+		# Counts X and O in every nrows x ncols tract of the data grid, tiling the tracts from the given offset.
+		# Only whole tracts are counted. Returns the X counts and O counts as 2D arrays with one value per tract.
+		# The prefix sum tables take 8 times the memory of the data grid, so memory-mapped grids are counted tile by tile instead.
+		if isinstance(self.numeric_grid, np.memmap):
+			return self.count_chars_in_tracts_by_tile(nrows, ncols, row_offset, col_offset)
+
+		r, h = self.numeric_grid.shape
+		row_starts = np.arange(row_offset, r - nrows + 1, nrows)
+		col_starts = np.arange(col_offset, h - ncols + 1, ncols)
+		top, bottom = np.ix_(row_starts, col_starts), np.ix_(row_starts + nrows, col_starts)
+		top_right, bottom_right = np.ix_(row_starts, col_starts + ncols), np.ix_(row_starts + nrows, col_starts + ncols)
+
+		return [table[bottom_right] - table[top_right] - table[bottom] + table[top] for table in self.get_prefix_sum_tables()]
+
+	def count_chars_in_tracts_by_tile(self, nrows, ncols, row_offset=0, col_offset=0):
+		# Counts X and O in every nrows x ncols tract like count_chars_in_tracts, reading the data grid one band of tracts at a time
+		r, h = self.numeric_grid.shape
+		tract_rows = max(0, (r - row_offset) // nrows)
+		tract_cols = max(0, (h - col_offset) // ncols)
+		char_counts = [[np.zeros((0, tract_cols), dtype=np.int64)] for char_value in (1, -1)]
+		for tile in self.get_tiles(nrows, row_offset, row_offset + tract_rows * nrows):
+			tracts = tile[:, col_offset:col_offset + tract_cols * ncols].reshape(tile.shape[0]//nrows, nrows, tract_cols, ncols)
+			for counts, char_value in zip(char_counts, (1, -1)):
+				counts.append(np.count_nonzero(tracts == char_value, axis=(1, 3)))
+
+		return [np.concatenate(counts) for counts in char_counts]
+
+	def calculate_window_dissimilarity_index(self, nrows, ncols, row_offset=0, col_offset=0):
+		# Calculates D for nrows x ncols tracts tiled from the given offset in O(1) per tract.
+		# With an offset the tracts do not cover the whole data grid, so the proportions are taken over the covered cells.
+		# Returns D and the 2D array of partial indices.
+		x_counts_in_tracts, o_counts_in_tracts = self.count_chars_in_tracts(nrows, ncols, row_offset, col_offset)
+		partial_indices = np.abs((x_counts_in_tracts/x_counts_in_tracts.sum()) - (o_counts_in_tracts/o_counts_in_tracts.sum()))
+
+		return [0.5*partial_indices.sum(), partial_indices]
+
+	def get_multiscale_dissimilarity(self):
+		# Calculates D for every tract size that splits the data grid evenly (every pair of divisors of its rows and columns).
+		# Returns a table with one row per tract size.
+		# pandas is only imported for the tables, so batch runs that do not need them start faster
+		import pandas as pd
+
+		r, h = self.numeric_grid.shape
+		results = []
+		for nrows in [divisor for divisor in range(1, r + 1) if r % divisor == 0]:
+			for ncols in [divisor for divisor in range(1, h + 1) if h % divisor == 0]:
+				D, partial_indices = self.calculate_window_dissimilarity_index(nrows, ncols)
+				results.append([nrows, ncols, partial_indices.size, D])
+
+		return pd.DataFrame(results, columns=['tract_rows', 'tract_cols', 'tracts_count', 'dissimilarity_index'])
+
+	def get_sliding_window_dissimilarity(self, nrows, ncols):
+		# Calculates D for nrows x ncols tracts at every offset of the tiling, which covers all the overlapping windows.
+		# Returns a table with one row per offset.
+		import pandas as pd
+
+		results = []
+		for row_offset in range(min(nrows, self.numeric_grid.shape[0] - nrows + 1)):
+			for col_offset in range(min(ncols, self.numeric_grid.shape[1] - ncols + 1)):
+				D, partial_indices = self.calculate_window_dissimilarity_index(nrows, ncols, row_offset, col_offset)
+				results.append([row_offset, col_offset, partial_indices.size, D])
+
+		return pd.DataFrame(results, columns=['row_offset', 'col_offset', 'tracts_count', 'dissimilarity_index'])
+
 	def calculate_partial_index(self, tract_data):
-		# Calculates the partial index per tract
-		x_count_in_tract = self.count_char(tract_data, 'X')
-		o_count_in_tract = self.count_char(tract_data, 'O')
+		# Calculates the partial index per tract of X, O and blank characters or of the numeric grid
+		if np.asarray(tract_data).dtype.kind in 'OUS':
+			x_count_in_tract = self.count_char(tract_data, 'X')
+			o_count_in_tract = self.count_char(tract_data, 'O')
+		else:
+			x_count_in_tract = np.count_nonzero(np.asarray(tract_data) == 1)
+			o_count_in_tract = np.count_nonzero(np.asarray(tract_data) == -1)
 
 		return abs((x_count_in_tract/self.total_X_count) - (o_count_in_tract/self.total_O_count))
 
@@ -0,0 +1,172 @@
+import numpy as np
+
+# Numeric value of every byte a cell can hold. X is 1, O is -1 and any other character is invalid.
+# Blank cells have no byte at all and are 0.
+INVALID_CELL = -128
+CELL_VALUES = np.full(256, INVALID_CELL, dtype=np.int8)
+CELL_VALUES[ord('X')] = 1
+CELL_VALUES[ord('O')] = -1
+
+# Character of every numeric value, indexed by value + 1
+CELL_CHARS = np.array(['O', '', 'X'], dtype=object)
+
+# Size in bytes of the blocks of rows parsed at once when a CSV file is loaded or streamed to a memory-mapped grid.
+# Parsing a block takes several times its size in memory, so blocks are kept small next to the grid itself.
+CHUNK_SIZE = 1 << 20
+
+# Number of cells processed at once when a large (memory-mapped) grid is scanned tile by tile. Processing a tile takes
+# tens of bytes per cell (neighbor counts, similarity ratios, ...), so a tile uses a few tens of MiB.
+TILE_CELLS = 1 << 20
+
+def get_tile_rows(data_grid):
+    # Gets the number of rows per tile so that a tile of the data grid holds about TILE_CELLS cells
+    return max(1, TILE_CELLS // max(1, data_grid.shape[1]))
+
+def clean_grid_rows(data):
+    # Gets the bytes of CSV rows without carriage returns and blank lines, with a line break at the end of every row
+    raw_bytes = np.frombuffer(data, dtype=np.uint8)
+    raw_bytes = raw_bytes[raw_bytes != ord('\r')]
+
+    is_line_break = raw_bytes == ord('\n')
+    is_blank_line = is_line_break & np.concatenate(([True], is_line_break[:-1]))
+    raw_bytes = raw_bytes[~is_blank_line]
+    if raw_bytes.size != 0 and raw_bytes[-1] != ord('\n'):
+        raw_bytes = np.append(raw_bytes, np.uint8(ord('\n')))
+
+    return raw_bytes
+
+def parse_grid_rows(data, ncols):
+    # Parses CSV rows (bytes, without the header) of X, O and blank cells straight into a contiguous int8 grid.
+    # Validation is done in the same pass: raises ValueError if a cell is not X, O or blank or if a row has more than ncols cells.
+    # Blank lines are skipped and the last row does not need a trailing line break
+    raw_bytes = clean_grid_rows(data)
+    if raw_bytes.size == 0:
+        return np.zeros((0, ncols), dtype=np.int8)
+
+    # Every cell ends with a separator, a comma or the line break of its row
+    separators = np.flatnonzero((raw_bytes == ord(',')) | (raw_bytes == ord('\n')))
+    line_breaks = raw_bytes[separators] == ord('\n')
+    cell_rows = np.cumsum(line_breaks) - line_breaks
+    row_first_cells = np.concatenate(([0], np.flatnonzero(line_breaks)[:-1] + 1))
+    cell_cols = np.arange(separators.size) - row_first_cells[cell_rows]
+    if cell_cols.max() >= ncols:
+        raise ValueError('A row of the data grid has more than %d cells.' % ncols)
+
+    cell_starts = np.concatenate(([0], separators[:-1] + 1))
+    cell_lengths = separators - cell_starts
+    cell_values = np.where(cell_lengths == 0, 0, CELL_VALUES[raw_bytes[cell_starts]]).astype(np.int8)
+    if (cell_lengths > 1).any() or (cell_values == INVALID_CELL).any():
+        raise ValueError('Invalid characters in the data. Only X, O and blank cells are allowed.')
+
+    # Rows with fewer cells than the header are completed with blank cells
+    data_grid = np.zeros((row_first_cells.size, ncols), dtype=np.int8)
+    data_grid[cell_rows, cell_cols] = cell_values
+    return data_grid
+
+def read_column_names(input_file):
+    # Reads the header line of an opened CSV file and returns the column names
+    return input_file.readline().decode().strip().split(',')
+
+def get_default_column_names(ncols):
+    # Gets the Col<column-#> column names for grids that are not read from a CSV file
+    return ['Col' + str(col + 1) for col in range(ncols)]
+
+def read_row_chunks(input_file, chunk_size=CHUNK_SIZE):
+    # Reads an opened CSV file in blocks of about chunk_size bytes that always end with a complete row
+    remaining_data = b''
+    while True:
+        data = input_file.read(chunk_size)
+        if not data:
+            break
+
+        data = remaining_data + data
+        last_line_break = data.rfind(b'\n')
+        remaining_data = data[last_line_break + 1:]
+        if last_line_break != -1:
+            yield data[:last_line_break + 1]
+
+    if remaining_data:
+        yield remaining_data
+
+def count_grid_rows(input_file, chunk_size=CHUNK_SIZE):
+    # Counts the rows of an opened CSV file from the current position to its end, blank lines excluded, one block at a time
+    return int(sum(np.count_nonzero(clean_grid_rows(data) == ord('\n')) for data in read_row_chunks(input_file, chunk_size)))
+
+def read_grid_rows(input_file, data_grid, chunk_size=CHUNK_SIZE):
+    # Parses the rows of an opened CSV file into a preallocated grid, one block of rows at a time
+    first_row = 0
+    for data in read_row_chunks(input_file, chunk_size):
+        rows = parse_grid_rows(data, data_grid.shape[1])
+        data_grid[first_row:first_row + rows.shape[0]] = rows
+        first_row += rows.shape[0]
+
+def load_grid(input_file_path, chunk_size=CHUNK_SIZE):
+    # Loads a CSV file of X, O and blank cells as a contiguous int8 grid. X is 1, O is -1 and blank is 0.
+    # The rows are counted in a first pass and parsed block by block into the grid, so only one block is parsed at a time.
+    # Returns the grid and the column names. Raises OSError for an invalid path and ValueError for invalid data.
+    with open(input_file_path, 'rb') as input_file:
+        column_names = read_column_names(input_file)
+        first_row_position = input_file.tell()
+        data_grid = np.zeros((count_grid_rows(input_file, chunk_size), len(column_names)), dtype=np.int8)
+        input_file.seek(first_row_position)
+        read_grid_rows(input_file, data_grid, chunk_size)
+
+    return [data_grid, column_names]
+
+def convert_csv_to_npy(input_file_path, output_file_path, chunk_size=CHUNK_SIZE):
+    # Streams a CSV file of X, O and blank cells into a memory-mapped int8 .npy file, one block of rows at a time,
+    # so that grids larger than the memory can be loaded. The rows are counted in a first pass to size the .npy file.
+    # Returns the memory-mapped grid and the column names. Raises ValueError for invalid data.
+    with open(input_file_path, 'rb') as input_file:
+        column_names = read_column_names(input_file)
+        first_row_position = input_file.tell()
+        nrows = count_grid_rows(input_file, chunk_size)
+
+        data_grid = np.lib.format.open_memmap(output_file_path, mode='w+', dtype=np.int8, shape=(nrows, len(column_names)))
+        input_file.seek(first_row_position)
+        read_grid_rows(input_file, data_grid, chunk_size)
+
+    data_grid.flush()
+    return [data_grid, column_names]
+
+def open_grid(grid_source, mmap_mode='r+'):
+    # Opens a data grid from a CSV file, from a compact int8 .npy file (memory-mapped, it is not read into memory)
+    # or from an existing numeric or memory-mapped array, which is used as it is.
+    # Returns the grid and the column names. Raises OSError for an invalid path and ValueError for invalid data.
+    if isinstance(grid_source, np.ndarray):
+        data_grid = grid_source
+    elif str(grid_source).endswith('.npy'):
+        data_grid = np.load(grid_source, mmap_mode=mmap_mode)
+    else:
+        return load_grid(grid_source)
+
+    # Grids that are not parsed from a CSV file are validated tile by tile
+    tile_rows = get_tile_rows(data_grid)
+    for first_row in range(0, data_grid.shape[0], tile_rows):
+        # Checked in the dtype of the file, a cast to int8 first would wrap values like 257 around to valid ones
+        if not np.isin(np.asarray(data_grid[first_row:first_row + tile_rows]), (-1, 0, 1)).all():
+            raise ValueError('Invalid values in the data grid. Only 1 (X), -1 (O) and 0 (blank) are allowed.')
+
+    return [data_grid, get_default_column_names(data_grid.shape[1])]
+
+def save_grid(data_grid, output_file_path, column_names=None):
+    # Saves a numeric grid as an int8 .npy file, or as a CSV file of X, O and blank cells like the input files.
+    # CSV rows are converted and written one tile at a time, so a memory-mapped grid is never read into memory as a whole.
+    if str(output_file_path).endswith('.npy'):
+        np.save(output_file_path, np.asarray(data_grid, dtype=np.int8))
+        return
+
+    cell_bytes = np.array([char.encode() for char in CELL_CHARS], dtype=object)
+    tile_rows = get_tile_rows(data_grid)
+    with open(output_file_path, 'wb') as output_file:
+        output_file.write((','.join(column_names or get_default_column_names(data_grid.shape[1])) + '\n').encode())
+        for first_row in range(0, data_grid.shape[0], tile_rows):
+            tile = cell_bytes[np.asarray(data_grid[first_row:first_row + tile_rows]) + 1]
+            output_file.write(b''.join(b','.join(row) + b'\n' for row in tile))
+
+def convert_grid_to_char_grid(data_grid, column_names=None):
+    # Converts a numeric grid back to X, O and blank cells for display or output, in a single lookup
+    # pandas is only imported here, so loading a grid does not pay for it
+    import pandas as pd
+
+    return pd.DataFrame(CELL_CHARS[np.asarray(data_grid) + 1], columns=column_names)
@@ -0,0 +1,65 @@
+import time
+import pandas as pd
+
+# Phases of a Schelling iteration that are timed separately.
+# 'evaluation' - finding the unsatisfied agents from their neighborhoods. The compiled kernel evaluates and moves the
+#                agents in a single pass, its whole time is counted here.
+# 'move'       - choosing the empty cells the agents move into and moving them (empty cells index included)
+# 'update'     - updating or recounting the neighbor counts and similarity ratios after the moves
+PHASES = ('evaluation', 'move', 'update')
+
+# Fields of every per-iteration record
+METRICS_FIELDS = ['iteration', 'unsatisfied_count', 'moves_count', 'empty_cells_count', 'similarity_ratio',
+    'evaluation_seconds', 'move_seconds', 'update_seconds', 'iteration_seconds']
+
+# Class that records the counters and timings of every iteration of a Schelling simulation
+#
+# Pass it as the metrics of a Schelling model (or set schelling.metrics). Models without metrics only check once per
+# phase that there is nothing to record, so the instrumentation costs next to nothing when it is disabled.
+# callback(record) is called with the record of every iteration right after it is made.
+class IterationMetrics:
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.records = []
+        self.start_iteration()
+
+    def start_iteration(self):
+        # Resets the counters and timings for the iteration that starts now
+        self.unsatisfied_count = 0
+        self.phase_seconds = dict.fromkeys(PHASES, 0.)
+        self.iteration_start = time.perf_counter()
+
+    def add_phase_time(self, phase, phase_start):
+        # Adds the time since phase_start to phase and returns the current time, which is the start of the next phase
+        now = time.perf_counter()
+        self.phase_seconds[phase] += now - phase_start
+        return now
+
+    def end_iteration(self, schelling, moves_count):
+        # Records the counters and timings of the iteration that just ended
+        record = {
+            'iteration': schelling.iterations,
+            'unsatisfied_count': self.unsatisfied_count,
+            'moves_count': moves_count,
+            'empty_cells_count': schelling.get_empty_cells_count(),
+            'similarity_ratio': schelling.similarity_history[-1] if schelling.similarity_history else None,
+            'iteration_seconds': time.perf_counter() - self.iteration_start}
+        for phase in PHASES:
+            record[phase + '_seconds'] = self.phase_seconds[phase]
+
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def get_dataframe(self):
+        # Gets the records as a table with one row per iteration
+        return pd.DataFrame(self.records, columns=METRICS_FIELDS)
+
+    def to_csv(self, output_file_path):
+        # Exports the records to a CSV file with one row per iteration
+        self.get_dataframe().to_csv(output_file_path, index=False)
+
+    def to_json(self, output_file_path):
+        # Exports the records to a JSON file as a list of one object per iteration (without indent, which needs pandas 1.0)
+        self.get_dataframe().to_json(output_file_path, orient='records')
@@ -0,0 +1,45 @@
+import numpy as np
+
+def create_simulation_figure(n_iterations):
+    # Creates the figure of the Schelling simulation once, with the data grid on the left and the mean similarity ratio on the right.
+    # Returns the figure and the artists that update_simulation_figure replaces the data of.
+    # matplotlib is only imported when a figure is made, so headless runs without plots do not pay for it
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+
+    plt.style.use("ggplot")
+    figure, (grid_axes, ratio_axes) = plt.subplots(1, 2, figsize=(8, 4))
+
+    # Left hand side graph with Schelling simulation plot, X is 1 (red), O is -1 (blue) and blank is 0 (white)
+    grid_axes.axis('off')
+    grid_axes.set_title("X - Red \nO - Blue", fontsize=10)
+    grid_image = grid_axes.imshow(np.zeros((1, 1)), cmap=ListedColormap(['royalblue', 'white', 'red']), vmin=-1, vmax=1,
+        interpolation='nearest')
+
+    # Right hand side graph with Mean Similarity Ratio graph
+    ratio_axes.set_xlabel("Iterations")
+    ratio_axes.set_xlim([0, n_iterations])
+    ratio_axes.set_ylim([0.4, 1])
+    ratio_axes.set_title("Mean Similarity Ratio", fontsize=12)
+    ratio_line, = ratio_axes.plot([], [])
+    ratio_text = ratio_axes.text(1, 0.95, "", fontsize=10)
+
+    return [figure, grid_image, ratio_line, ratio_text]
+
+def update_simulation_figure(simulation_figure, data_grid, similarity_history):
+    # Replaces the data grid image and the mean similarity ratio line of the figure. Nothing is drawn again from scratch,
+    # which is much cheaper than a new figure with one pcolor cell per agent.
+    figure, grid_image, ratio_line, ratio_text = simulation_figure
+    grid_image.set_data(data_grid)
+    grid_image.set_extent((-0.5, data_grid.shape[1] - 0.5, data_grid.shape[0] - 0.5, -0.5))
+    ratio_line.set_data(range(1, len(similarity_history) + 1), similarity_history)
+    ratio_text.set_text("Similarity Ratio: %.4f" % similarity_history[-1] if similarity_history else "")
+
+def save_simulation_plot(schelling, n_iterations, output_file_path):
+    # Saves the figure of the Schelling simulation (data grid and mean similarity ratio) to an image file
+    import matplotlib.pyplot as plt
+
+    simulation_figure = create_simulation_figure(n_iterations)
+    update_simulation_figure(simulation_figure, schelling.data_grid, schelling.similarity_history)
+    simulation_figure[0].savefig(output_file_path)
+    plt.close(simulation_figure[0])
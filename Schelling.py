@@ -1,16 +1,259 @@
-import random
+import time
 import numpy as np
 
+import SchellingKernel
+from GridLoader import get_tile_rows
+
+# Simulation engines that can be selected when creating a Schelling model.
+# 'reference'  - the original per-cell loop. Agents are visited in row-major order and each move is applied immediately
+#                (sequential update), so agents visited later already see the moves of the agents visited before them.
+# 'vectorized' - like-neighbor and occupied-neighbor counts are computed for the whole grid at once from summed-area tables.
+#                Every agent is evaluated against the grid as it was at the start of the iteration and all unsatisfied
+#                agents are moved in one batch (synchronous update). The destinations are drawn without replacement from
+#                the cells that were empty at the start of the iteration plus the cells vacated by the moving agents.
+# 'compiled'   - the reference loop compiled with numba, with the same sequential update and neighborhoods. Falls back to
+#                the reference loop when numba is not installed.
+# 'tiled'      - the same synchronous update as 'vectorized' for grids that do not fit in memory, like memory-mapped grids
+#                from GridLoader. No per-cell field or cell list is kept: the unsatisfied agents are marked and moved tile
+#                by tile (bands of rows read together with the rows their neighborhoods need), so the memory used only
+#                depends on the size of a tile.
+ENGINES = ('reference', 'vectorized', 'compiled', 'tiled')
+
+def get_window_bounds(axis_length, neighbors_count):
+    # Gets the start and stop of the neighborhood slice [index-neighbors_count:index+neighbors_count] for every index of one axis.
+    # The bounds are resolved the same way Python resolves slice bounds so that both engines use the exact same neighborhoods.
+    index = np.arange(axis_length)
+    start = index - neighbors_count
+    start = np.where(start < 0, np.maximum(start + axis_length, 0), start)
+    stop = np.minimum(index + neighbors_count, axis_length)
+
+    # An empty slice (start >= stop) is represented with stop == start so it counts nothing
+    return start, np.maximum(stop, start)
+
+def get_window_members(window_start, window_stop):
+    # Inverts the window bounds of one axis: for every position, gets the indices whose neighborhood window contains it.
+    # These are the rows (or columns) whose neighbor counts change when the cell at that position changes.
+    window_lengths = window_stop - window_start
+    owners = np.repeat(np.arange(window_lengths.size), window_lengths)
+    offsets = np.arange(owners.size) - np.repeat(np.cumsum(window_lengths) - window_lengths, window_lengths)
+    positions = np.repeat(window_start, window_lengths) + offsets
+
+    order = np.argsort(positions, kind='stable')
+    boundaries = np.searchsorted(positions[order], np.arange(1, window_lengths.size))
+
+    # Members are usually a contiguous range, which is kept as a slice so the fields can be updated through views
+    window_members = []
+    for members in np.split(owners[order], boundaries):
+        if members.size > 0 and members[-1] - members[0] == members.size - 1:
+            members = slice(members[0], members[-1] + 1)
+        window_members.append(members)
+
+    return window_members
+
+def get_block(row_members, col_members):
+    # Gets the index of the block of cells at the intersection of the given rows and columns
+    if isinstance(row_members, slice) and isinstance(col_members, slice):
+        return row_members, col_members
+
+    if isinstance(row_members, slice):
+        row_members = np.arange(row_members.start, row_members.stop)
+    if isinstance(col_members, slice):
+        col_members = np.arange(col_members.start, col_members.stop)
+    return np.ix_(row_members, col_members)
+
+def get_similarity_ratios_from_counts(data_grid, X_counts, O_counts):
+    # Calculates the similarity ratio of every agent from the X and O counts of its neighborhood (itself included),
+    # with a mask of the agents that get a ratio. Agents with no other occupied cell in their neighborhood get none.
+    occupied_counts = X_counts + O_counts
+    like_counts = np.where(data_grid == 1, X_counts, O_counts)
+    has_ratio = (data_grid != 0) & (occupied_counts != 1)
+
+    similarity_ratios = np.zeros(data_grid.shape)
+    np.divide(like_counts - 1, occupied_counts - 1., out=similarity_ratios, where=has_ratio)
+
+    return similarity_ratios, has_ratio
+
+def count_in_windows(mask, row_bounds, col_bounds, dtype=np.int64):
+    # Counts the True cells of the mask inside the neighborhood window of every cell using a summed-area table
+    rows, cols = mask.shape
+    table = np.zeros((rows + 1, cols + 1), dtype=dtype)
+    np.cumsum(np.cumsum(mask, axis=0), axis=1, out=table[1:, 1:])
+
+    row_start, row_stop = row_bounds
+    col_start, col_stop = col_bounds
+    return (table[np.ix_(row_stop, col_stop)] - table[np.ix_(row_start, col_stop)]
+        - table[np.ix_(row_stop, col_start)] + table[np.ix_(row_start, col_start)])
+
+# Class that keeps the flat indices of the empty cells of a data grid.
+# The cells are stored in an array and a position map gives the slot of each cell in that array, so a random empty cell
+# can be sampled, added or swap-removed in O(1) regardless of the size of the data grid.
+class EmptyCellIndex:
+
+    def __init__(self, data_grid):
+        index_dtype = np.int32 if data_grid.size < np.iinfo(np.int32).max else np.int64
+        empty_cells = np.flatnonzero(data_grid == 0).astype(index_dtype)
+
+        # The spare slot of an index without empty cells holds -1 rather than garbage
+        self.cells = np.full(max(empty_cells.size, 1), -1, dtype=index_dtype)
+        self.cells[:empty_cells.size] = empty_cells
+        self.size = empty_cells.size
+        self.positions = np.full(data_grid.size, -1, dtype=index_dtype)
+        self.positions[empty_cells] = np.arange(empty_cells.size, dtype=index_dtype)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        return self.positions[cell] != -1
+
+    def get_cells(self):
+        # Gets a view of the empty cells currently in the index
+        return self.cells[:self.size]
+
+    def sample(self, random_draw):
+        # Picks the empty cell matching a random draw from [0, 1)
+        if self.size == 0:
+            raise IndexError('Cannot choose from an empty index')
+
+        return int(self.cells[int(random_draw * self.size)])
+
+    def add(self, cell):
+        # Adds a cell that became empty, growing the storage like a list when it is full
+        if self.size == self.cells.size:
+            self.cells = np.concatenate((self.cells, np.empty(self.cells.size, dtype=self.cells.dtype)))
+
+        self.cells[self.size] = cell
+        self.positions[cell] = self.size
+        self.size += 1
+
+    def remove(self, cell):
+        # Removes a cell that got occupied by moving the last cell of the index into its slot
+        position = self.positions[cell]
+        last_cell = self.cells[self.size - 1]
+        self.cells[position] = last_cell
+        self.positions[last_cell] = position
+        self.positions[cell] = -1
+        self.size -= 1
+
+    def move(self, occupied_cell, vacated_cell):
+        # Records an agent moving into occupied_cell from vacated_cell, the vacated cell simply takes over the slot
+        position = self.positions[occupied_cell]
+        self.cells[position] = vacated_cell
+        self.positions[vacated_cell] = position
+        self.positions[occupied_cell] = -1
+
+    def reset(self, occupied_cells, empty_cells):
+        # Replaces the content of the index after a batch of moves. Only the cells that changed are touched.
+        self.positions[occupied_cells] = -1
+        if empty_cells.size > self.cells.size:
+            self.cells = np.empty(empty_cells.size, dtype=self.cells.dtype)
+
+        self.cells[:empty_cells.size] = empty_cells
+        self.size = empty_cells.size
+        self.positions[empty_cells] = np.arange(empty_cells.size, dtype=self.positions.dtype)
+
 # Class that handles Schelling Agent attributes and methods
+#
+# All the randomness of a simulation is drawn in bulk, once per iteration, from the numpy Generator created from the
+# seed, so two models with the same input data, parameters and seed run exactly the same, whatever the engine.
+#
+# The neighbor counts of every cell (X and O inside its neighborhood window) are kept as fields next to the data grid,
+# together with the similarity ratio of every agent and their running sum. A move only updates the windows that contain
+# the vacated or the occupied cell, so the mean similarity ratio is available in constant time after every iteration.
+#
+# With metrics (see Metrics.IterationMetrics), the counters and the time of every phase of every iteration are recorded.
 class Schelling:
-    
-    def __init__(self, input_data, similarity_threshold, neighbors_count):
+
+    def __init__(self, input_data, similarity_threshold, neighbors_count, engine='reference', warm_up=False, seed=None, metrics=None):
+        if engine not in ENGINES:
+            raise ValueError("Unknown simulation engine '%s'. Expected one of: %s" % (engine, ', '.join(ENGINES)))
+
         self.similarity_threshold = similarity_threshold
         self.neighbors_count = neighbors_count
-        self.data_grid = input_data.values
-    
+        self.engine = engine
+        self.metrics = metrics
+        self.rng = np.random.default_rng(seed)
+        # Works on the data grid in place. Compact int8 grids from GridLoader (memory-mapped or not) and DataFrames are accepted.
+        self.data_grid = input_data if isinstance(input_data, np.ndarray) else np.asarray(input_data)
+
+        rows, cols = self.data_grid.shape
+        self.row_bounds = get_window_bounds(rows, neighbors_count)
+        self.col_bounds = get_window_bounds(cols, neighbors_count)
+        if engine == 'tiled':
+            self.scan_tiles()
+        else:
+            self.empty_cells = EmptyCellIndex(self.data_grid)
+            self.row_members = get_window_members(*self.row_bounds)
+            self.col_members = get_window_members(*self.col_bounds)
+            self.refresh_neighbor_counts()
+
+        # Number of iterations run so far and the mean similarity ratio before the first and after every iteration
+        self.iterations = 0
+        self.similarity_history = [self.get_average_similarity_ratio()] if self.rated_agents_count else []
+
+        # Compiles the kernel right away instead of during the first iteration
+        if engine == 'compiled' and warm_up:
+            SchellingKernel.warm_up_kernel(self.data_grid.dtype, self.empty_cells.cells.dtype)
+
     def run_simulation(self):
-        # Runs the Schelling's segregation model simulation for one iteration.
+        # Runs the Schelling's segregation model simulation for one iteration with the selected engine.
+        # Returns the number of agents that moved.
+        if self.metrics is not None:
+            self.metrics.start_iteration()
+
+        if self.engine == 'vectorized':
+            moves_count = self.run_vectorized_simulation()
+        elif self.engine == 'compiled':
+            moves_count = self.run_compiled_simulation()
+        elif self.engine == 'tiled':
+            moves_count = self.run_tiled_simulation()
+        else:
+            moves_count = self.run_reference_simulation()
+
+        self.iterations += 1
+        if self.rated_agents_count:
+            self.similarity_history.append(self.get_average_similarity_ratio())
+
+        if self.metrics is not None:
+            self.metrics.end_iteration(self, moves_count)
+
+        return moves_count
+
+    def run_until_stable(self, max_iterations, tolerance=0., patience=1, callback=None):
+        # Runs iterations until the model is stable or max_iterations iterations have run, calling callback(self, moves_count)
+        # after every iteration. The model is stable as soon as no agent moves, or when either the share of agents that
+        # moved or the change of the mean similarity ratio stays under the tolerance for patience iterations in a row.
+        # Returns the number of iterations run and the reason why the run stopped.
+        agents_count = np.count_nonzero(self.data_grid)
+        few_moves_streak = 0
+        stable_similarity_streak = 0
+        for iteration in range(1, max_iterations + 1):
+            moves_count = self.run_simulation()
+            if callback is not None:
+                callback(self, moves_count)
+
+            if moves_count == 0:
+                return [iteration, 'NO_MOVES']
+
+            few_moves_streak = few_moves_streak + 1 if moves_count < tolerance * agents_count else 0
+            similarity_change = abs(self.similarity_history[-1] - self.similarity_history[-2]) if len(self.similarity_history) > 1 else 0.
+            stable_similarity_streak = stable_similarity_streak + 1 if similarity_change < tolerance else 0
+
+            if few_moves_streak >= patience:
+                return [iteration, 'FEW_MOVES']
+            elif stable_similarity_streak >= patience:
+                return [iteration, 'SIMILARITY_STABLE']
+
+        return [max_iterations, 'MAX_ITERATIONS']
+
+    def run_reference_simulation(self):
+        # Runs one iteration by visiting every cell and moving each unsatisfied agent right away (sequential update).
+        # An agent may move at every visited cell, so there is one random draw per cell and each move uses the next one.
+        random_draws = iter(self.rng.random(self.data_grid.size))
+        cols = self.data_grid.shape[1]
+        moves_count = 0
+        metrics = self.metrics
+        phase_start = time.perf_counter() if metrics is not None else 0.
         for (row, col), value in np.ndenumerate(self.data_grid):
             char_type = self.data_grid[row, col]
             if char_type != 0:
@@ -25,15 +268,268 @@ class Schelling:
                     # Char is unsatisfied if its similarity ratio is lower than the similarity threshold
                     is_unsatisfied = (similarity_ratio < self.similarity_threshold)
                     if is_unsatisfied:
-                        empty_cells = list(zip(np.where(self.data_grid == 0)[0], np.where(self.data_grid == 0)[1]))
-                        
+                        if metrics is not None:
+                            phase_start = metrics.add_phase_time('evaluation', phase_start)
+
                         # The unsatisfied char type will randomly move to empty cell in the grid and its previous location will now become empty
-                        random_empty_cell = random.choice(empty_cells)
-                        self.data_grid[random_empty_cell] = char_type
+                        random_empty_cell = self.empty_cells.sample(next(random_draws))
+                        self.data_grid.flat[random_empty_cell] = char_type
                         self.data_grid[row,col] = 0
+                        self.empty_cells.move(random_empty_cell, row * cols + col)
+                        if metrics is not None:
+                            phase_start = metrics.add_phase_time('move', phase_start)
+
+                        self.update_neighbor_counts(row * cols + col, random_empty_cell, char_type)
+                        moves_count += 1
+                        if metrics is not None:
+                            phase_start = metrics.add_phase_time('update', phase_start)
+
+        # Drops the rounding error accumulated by the incremental updates of the running sum
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('evaluation', phase_start)
+        self.similarity_ratio_sum = float(self.similarity_ratios.sum())
+        if metrics is not None:
+            # Every unsatisfied agent moves right away
+            metrics.add_phase_time('update', phase_start)
+            metrics.unsatisfied_count = moves_count
+
+        return moves_count
+
+    def run_vectorized_simulation(self):
+        # Runs one iteration by finding all unsatisfied agents in one pass and moving them in a batch (synchronous update).
+        metrics = self.metrics
+        phase_start = time.perf_counter() if metrics is not None else 0.
+        unsatisfied_cells = np.flatnonzero(self.has_ratio & (self.similarity_ratios < self.similarity_threshold))
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('evaluation', phase_start)
+            metrics.unsatisfied_count = unsatisfied_cells.size
+        if unsatisfied_cells.size == 0:
+            return 0
+
+        # Vacated cells are part of the destinations so every unsatisfied agent can be placed, even on a full grid.
+        # Whatever is left of the shuffled destinations is exactly the set of empty cells after the batch.
+        shuffled_cells = self.rng.permutation(np.concatenate((self.empty_cells.get_cells(), unsatisfied_cells)))
+        destinations = shuffled_cells[:unsatisfied_cells.size]
+
+        char_types = self.data_grid.flat[unsatisfied_cells]
+        self.data_grid.flat[unsatisfied_cells] = 0
+        self.data_grid.flat[destinations] = char_types
+        self.empty_cells.reset(destinations, shuffled_cells[unsatisfied_cells.size:])
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('move', phase_start)
+
+        # A batch touches most windows of the grid, recounting them all at once is cheaper than one update per move
+        self.refresh_neighbor_counts()
+        if metrics is not None:
+            metrics.add_phase_time('update', phase_start)
+
+        # An agent whose destination is the cell it just vacated did not move
+        return int(np.count_nonzero(destinations != unsatisfied_cells))
+
+    def run_compiled_simulation(self):
+        # Runs one iteration of the reference loop with the numba kernel, or with the reference loop itself without numba.
+        if not SchellingKernel.NUMBA_AVAILABLE:
+            return self.run_reference_simulation()
+
+        # Same random draws as the reference loop, so both engines give the same result for the same seed
+        metrics = self.metrics
+        phase_start = time.perf_counter() if metrics is not None else 0.
+        random_draws = self.rng.random(self.data_grid.size)
+        moves_count = SchellingKernel.get_sequential_kernel()(self.data_grid, self.similarity_threshold,
+            self.row_bounds[0], self.row_bounds[1], self.col_bounds[0], self.col_bounds[1],
+            self.empty_cells.cells, self.empty_cells.positions, len(self.empty_cells), random_draws)
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('evaluation', phase_start)
+            metrics.unsatisfied_count = moves_count
+
+        # The kernel does not keep the neighbor count fields up to date, they are recounted once for the whole iteration
+        self.refresh_neighbor_counts()
+        if metrics is not None:
+            metrics.add_phase_time('update', phase_start)
+
+        return moves_count
+
+    def run_tiled_simulation(self):
+        # Runs one iteration with the same synchronous update as run_vectorized_simulation, tile by tile, so that no array
+        # larger than a tile is ever needed. Unsatisfied agents are marked in the data grid in a first pass, then the agents
+        # are spread over the tiles and placed in a second pass. The scan that follows the moves is timed as the update.
+        metrics = self.metrics
+        phase_start = time.perf_counter() if metrics is not None else 0.
+        if metrics is not None:
+            metrics.unsatisfied_count = self.scanned_unsatisfied_count
+        if self.scanned_unsatisfied_count == 0:
+            return 0
+
+        candidate_counts, unsatisfied_X_count = self.mark_unsatisfied_agents()
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('evaluation', phase_start)
+
+        moves_count = self.place_marked_agents(candidate_counts, unsatisfied_X_count)
+        if metrics is not None:
+            phase_start = metrics.add_phase_time('move', phase_start)
+
+        self.scan_tiles()
+        if metrics is not None:
+            metrics.add_phase_time('update', phase_start)
+
+        return moves_count
+
+    def mark_unsatisfied_agents(self):
+        # Marks every unsatisfied agent in the data grid as 2 (X) or -2 (O), tile by tile. Neighbors are counted by their sign,
+        # so the marks of the tiles above do not change the evaluation of the next tile.
+        # Returns the number of destination cells (empty or marked) of every tile and the number of unsatisfied X agents.
+        rows = self.data_grid.shape[0]
+        tile_rows = get_tile_rows(self.data_grid)
+        candidate_counts = []
+        unsatisfied_X_count = 0
+        for first_row in range(0, rows, tile_rows):
+            last_row = min(first_row + tile_rows, rows)
+            tile = np.array(self.data_grid[first_row:last_row])
+            similarity_ratios, has_ratio = get_similarity_ratios_from_counts(tile, *self.count_tile_neighbors(first_row, last_row))
+            is_unsatisfied = has_ratio & (similarity_ratios < self.similarity_threshold)
+
+            self.data_grid[first_row:last_row][is_unsatisfied] = tile[is_unsatisfied] * 2
+            candidate_counts.append(int(np.count_nonzero(is_unsatisfied)) + int(np.count_nonzero(tile == 0)))
+            unsatisfied_X_count += int(np.count_nonzero(is_unsatisfied & (tile == 1)))
+
+        return candidate_counts, unsatisfied_X_count
+
+    def place_marked_agents(self, candidate_counts, unsatisfied_X_count):
+        # Moves the marked agents to destinations drawn without replacement from the empty and marked cells, tile by tile.
+        # The number of agents landing in each tile, and how many of them are X, follow the hypergeometric distribution,
+        # which gives the same destinations as one shuffle of all the candidate cells of the data grid.
+        # Returns the number of agents that moved, an agent landing on a cell vacated by an agent of its own type did not move.
+        rows = self.data_grid.shape[0]
+        tile_rows = get_tile_rows(self.data_grid)
+        candidates_left = sum(candidate_counts)
+        agents_left = self.scanned_unsatisfied_count
+        X_agents_left = unsatisfied_X_count
+        moves_count = 0
+        for first_row, candidate_count in zip(range(0, rows, tile_rows), candidate_counts):
+            tile_agents = int(self.rng.hypergeometric(candidate_count, candidates_left - candidate_count, agents_left)) if agents_left else 0
+            tile_X_agents = int(self.rng.hypergeometric(X_agents_left, agents_left - X_agents_left, tile_agents)) if tile_agents else 0
+            candidates_left -= candidate_count
+            agents_left -= tile_agents
+            X_agents_left -= tile_X_agents
+
+            tile = self.data_grid[first_row:first_row + tile_rows]
+            previous_values = np.asarray(tile).ravel()
+            candidate_cells = np.flatnonzero((previous_values == 0) | (np.abs(previous_values) == 2))
+            previous_values = np.sign(previous_values[candidate_cells])
+
+            # The sample is in random order, so its first cells get the X agents
+            destinations = self.rng.choice(candidate_cells.size, tile_agents, replace=False)
+            new_values = np.zeros(candidate_cells.size, dtype=tile.dtype)
+            new_values[destinations[:tile_X_agents]] = 1
+            new_values[destinations[tile_X_agents:]] = -1
+            tile.flat[candidate_cells] = new_values
+            moves_count += int(np.count_nonzero((new_values != 0) & (new_values != previous_values)))
+
+        return moves_count
+
+    def count_tile_neighbors(self, first_row, last_row):
+        # Counts X and O in the neighborhood of every cell of the rows first_row to last_row (excluded).
+        # Only these rows and the rows their neighborhoods need are read from the data grid.
+        row_start = self.row_bounds[0][first_row:last_row]
+        row_stop = self.row_bounds[1][first_row:last_row]
+        # Empty windows (the first rows, whose slice start wraps around) count nothing and must not widen the rows read
+        is_empty_window = row_stop == row_start
+        first_window_row = int(row_start[~is_empty_window].min(initial=first_row))
+        last_window_row = int(row_stop[~is_empty_window].max(initial=first_row))
+        window_rows = np.asarray(self.data_grid[first_window_row:last_window_row])
+        row_bounds = (np.where(is_empty_window, 0, row_start - first_window_row), np.where(is_empty_window, 0, row_stop - first_window_row))
+
+        window_size = int((self.row_bounds[1] - self.row_bounds[0]).max(initial=0) * (self.col_bounds[1] - self.col_bounds[0]).max(initial=0))
+        count_dtype = np.int16 if window_size <= np.iinfo(np.int16).max else np.int32
+        # Counted by sign, so agents marked by mark_unsatisfied_agents still count as X or O
+        X_counts = count_in_windows(window_rows > 0, row_bounds, self.col_bounds).astype(count_dtype)
+        O_counts = count_in_windows(window_rows < 0, row_bounds, self.col_bounds).astype(count_dtype)
+
+        return X_counts, O_counts
+
+    def scan_tiles(self):
+        # Scans the data grid tile by tile to get the running similarity ratio sum and the numbers of unsatisfied agents
+        # and of empty cells. No per-cell field is kept, only one tile is in memory at a time.
+        rows = self.data_grid.shape[0]
+        tile_rows = get_tile_rows(self.data_grid)
+        self.similarity_ratio_sum = 0.
+        self.rated_agents_count = 0
+        self.scanned_unsatisfied_count = 0
+        self.scanned_empty_cells_count = 0
+        for first_row in range(0, rows, tile_rows):
+            last_row = min(first_row + tile_rows, rows)
+            tile = np.asarray(self.data_grid[first_row:last_row])
+            similarity_ratios, has_ratio = get_similarity_ratios_from_counts(tile, *self.count_tile_neighbors(first_row, last_row))
+
+            self.similarity_ratio_sum += float(similarity_ratios.sum())
+            self.rated_agents_count += int(np.count_nonzero(has_ratio))
+            self.scanned_unsatisfied_count += int(np.count_nonzero(has_ratio & (similarity_ratios < self.similarity_threshold)))
+            self.scanned_empty_cells_count += int(np.count_nonzero(tile == 0))
+
+    def refresh_neighbor_counts(self):
+        # Recounts the neighbor count fields, similarity ratios and their running sum for the whole data grid
+        self.X_counts, self.O_counts = self.count_tile_neighbors(0, self.data_grid.shape[0])
+        self.similarity_ratios = np.zeros(self.data_grid.shape)
+        self.has_ratio = np.zeros(self.data_grid.shape, dtype=bool)
+
+        self.similarity_ratio_sum = 0.
+        self.rated_agents_count = 0
+        self.update_similarity_ratios(np.s_[:, :])
+
+    def update_neighbor_counts(self, vacated_cell, occupied_cell, char_type):
+        # Updates the neighbor count fields after an agent of char_type moved from vacated_cell to occupied_cell.
+        # Only the windows containing either cell change, plus both cells themselves since their char type changed.
+        char_counts = self.X_counts if char_type == 1 else self.O_counts
+        cols = self.data_grid.shape[1]
+        changed_blocks = []
+        for cell, count_change in ((vacated_cell, -1), (occupied_cell, 1)):
+            row, col = divmod(int(cell), cols)
+            window_block = get_block(self.row_members[row], self.col_members[col])
+            char_counts[window_block] += count_change
+            changed_blocks.append(window_block)
+            if not (self.row_bounds[0][row] <= row < self.row_bounds[1][row] and self.col_bounds[0][col] <= col < self.col_bounds[1][col]):
+                changed_blocks.append(np.s_[row:row+1, col:col+1])
+
+        # Blocks may overlap. Each update compares with the stored ratios, so an overlap is only counted once.
+        for block in changed_blocks:
+            self.update_similarity_ratios(block)
+
+    def update_similarity_ratios(self, block):
+        # Recalculates the similarity ratios of the cells in the block and adjusts the running sum and agent count
+        similarity_ratios, has_ratio = get_similarity_ratios_from_counts(self.data_grid[block], self.X_counts[block], self.O_counts[block])
+
+        self.similarity_ratio_sum += float((similarity_ratios - self.similarity_ratios[block]).sum())
+        self.rated_agents_count += int(np.count_nonzero(has_ratio)) - int(np.count_nonzero(self.has_ratio[block]))
+        self.similarity_ratios[block] = similarity_ratios
+        self.has_ratio[block] = has_ratio
+
+    def get_neighbor_counts(self):
+        # Gets the like-type and occupied cell counts in the neighborhood of every cell of the data grid.
+        # Both counts include the cell itself, the same way the neighborhood slice of the reference loop does.
+        # The tiled engine keeps no neighbor count field, so they are counted for the whole data grid.
+        X_counts, O_counts = self.count_tile_neighbors(0, self.data_grid.shape[0]) if self.engine == 'tiled' else (self.X_counts, self.O_counts)
+        like_counts = np.where(self.data_grid == 1, X_counts, O_counts)
+
+        return like_counts, X_counts + O_counts
+
+    def get_similarity_ratios(self):
+        # Gets the similarity ratio of every agent and a mask of the agents that get a ratio.
+        if self.engine == 'tiled':
+            return get_similarity_ratios_from_counts(self.data_grid, *self.count_tile_neighbors(0, self.data_grid.shape[0]))
+
+        return self.similarity_ratios, self.has_ratio
+
+    def get_empty_cells_count(self):
+        # Gets the number of empty cells of the data grid
+        return self.scanned_empty_cells_count if self.engine == 'tiled' else len(self.empty_cells)
 
     def get_average_similarity_ratio(self):
-        # Calculates the average similarity ratio across all agents for the entire data grid
+        # Gets the average similarity ratio across all agents for the entire data grid from the running sum
+        return self.similarity_ratio_sum / self.rated_agents_count
+
+    def calculate_average_similarity_ratio(self):
+        # Calculates the average similarity ratio across all agents by scanning every neighborhood of the data grid.
+        # This is the original calculation, kept as a reference for the running sum of get_average_similarity_ratio.
         count = 0
         similarity_ratio = 0
         for (row, col), value in np.ndenumerate(self.data_grid):
@@ -0,0 +1,84 @@
+import importlib.util
+import numpy as np
+
+# Numba is optional. Without it the compiled engine of the Schelling class falls back to the reference loop.
+# Numba is only imported when the kernel is first needed, so that importing Schelling stays fast for the other engines.
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+# Kernel compiled by numba, created once per process by get_sequential_kernel
+compiled_kernel = None
+
+# Signatures (grid dtype, index dtype) that have already been compiled in this process
+warmed_up_signatures = set()
+
+def run_sequential_kernel(data_grid, similarity_threshold, row_start, row_stop, col_start, col_stop,
+        empty_cells, empty_positions, empty_cells_count, random_draws):
+    # Runs one iteration of the reference loop: cells are visited in row-major order and each unsatisfied agent moves
+    # right away to a random empty cell. Neighborhoods are the same windows as the reference slices (see get_window_bounds).
+    # The empty cells index (cells, positions and size) is updated in place and the number of moves is returned.
+    rows, cols = data_grid.shape
+    moves_count = 0
+    for row in range(rows):
+        for col in range(cols):
+            char_type = data_grid[row, col]
+            if char_type == 0:
+                continue
+
+            X_count = 0
+            O_count = 0
+            for neighbor_row in range(row_start[row], row_stop[row]):
+                for neighbor_col in range(col_start[col], col_stop[col]):
+                    if data_grid[neighbor_row, neighbor_col] == 1:
+                        X_count += 1
+                    elif data_grid[neighbor_row, neighbor_col] == -1:
+                        O_count += 1
+
+            occupied_count = X_count + O_count
+            if occupied_count == 1:
+                continue
+
+            like_count = X_count if char_type == 1 else O_count
+            similarity_ratio = (like_count - 1) / (occupied_count - 1.)
+            if similarity_ratio < similarity_threshold:
+                # Same error as EmptyCellIndex.sample, the index is not bounds checked once compiled
+                if empty_cells_count == 0:
+                    raise IndexError('Cannot choose from an empty index')
+
+                # The vacated cell takes over the slot of the empty cell the agent moves into
+                slot = int(random_draws[moves_count] * empty_cells_count)
+                random_empty_cell = empty_cells[slot]
+                vacated_cell = row * cols + col
+                data_grid[random_empty_cell // cols, random_empty_cell % cols] = char_type
+                data_grid[row, col] = 0
+                empty_cells[slot] = vacated_cell
+                empty_positions[vacated_cell] = slot
+                empty_positions[random_empty_cell] = -1
+                moves_count += 1
+
+    return moves_count
+
+def get_sequential_kernel():
+    # Gets run_sequential_kernel compiled by numba, or the Python function itself when numba is missing.
+    # Compiled functions are cached on disk so a new process (or a Streamlit rerun) does not compile them again.
+    global compiled_kernel
+    if not NUMBA_AVAILABLE:
+        return run_sequential_kernel
+
+    if compiled_kernel is None:
+        import numba
+        compiled_kernel = numba.njit(cache=True, nogil=True)(run_sequential_kernel)
+
+    return compiled_kernel
+
+def warm_up_kernel(grid_dtype, index_dtype):
+    # Compiles the kernel for the given data grid and empty cells index dtypes on a tiny grid, so the first iteration
+    # of a simulation does not pay for the compilation. Does nothing if it was already done or if numba is missing.
+    signature = (np.dtype(grid_dtype), np.dtype(index_dtype))
+    if not NUMBA_AVAILABLE or signature in warmed_up_signatures:
+        return
+
+    data_grid = np.array([[1, 0], [-1, 1]], dtype=grid_dtype)
+    bounds = np.array([0, 0]), np.array([2, 2])
+    get_sequential_kernel()(data_grid, 0.5, bounds[0], bounds[1], bounds[0], bounds[1],
+        np.array([1], dtype=index_dtype), np.array([-1, 0, -1, -1], dtype=index_dtype), 1, np.zeros(4))
+    warmed_up_signatures.add(signature)
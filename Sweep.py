@@ -0,0 +1,95 @@
+import os
+import sys
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from Schelling import Schelling as SchellingModel
+from Schelling import ENGINES as SCHELLING_ENGINES
+from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+from GridLoader import open_grid
+
+# Columns of the table returned by run_sweep, one row per run
+SWEEP_COLUMNS = ['similarity_threshold', 'neighbors_count', 'seed', 'iterations', 'converged', 'stop_reason',
+    'similarity_ratio', 'dissimilarity_index']
+
+# Input data grid of the worker process. It is handed over once per worker by the pool initializer instead of being
+# pickled along with every task, and is never written to since each run works on its own copy.
+# A memory-mapped .npy grid is handed over as its file path, so all the workers map the same pages of that file.
+shared_data_grid = None
+
+def init_worker(grid_source):
+    # Keeps the input data grid (or maps the .npy file) for every task run by this worker process
+    global shared_data_grid
+    shared_data_grid = open_grid(grid_source, mmap_mode='r')[0] if isinstance(grid_source, str) else grid_source
+    shared_data_grid.flags.writeable = False
+
+def run_sweep_task(similarity_threshold, neighbors_count, seed, n_iterations, tolerance, patience, engine, tract_rows, tract_cols):
+    # Runs one Schelling simulation on a copy of the shared input data grid until it is stable or n_iterations is reached
+    schelling = SchellingModel(shared_data_grid.copy(), similarity_threshold, neighbors_count, engine, seed=seed)
+    iterations, stop_reason = schelling.run_until_stable(n_iterations, tolerance, patience)
+
+    # Index of Dissimilarity of the final data grid for the given tract size, none without a tract size
+    D = np.nan
+    if tract_rows is not None:
+        D = DissimilaritySegregationModel(schelling.data_grid).calculate_dissimilarity_index(tract_rows, tract_cols)[0]
+
+    return [similarity_threshold, neighbors_count, seed, iterations, stop_reason != 'MAX_ITERATIONS', stop_reason,
+        schelling.get_average_similarity_ratio(), D]
+
+def run_sweep(data_grid, similarity_thresholds, neighbors_counts, seeds, n_iterations=20, tolerance=0., patience=1,
+        engine='vectorized', tract_rows=None, tract_cols=1, max_workers=None):
+    # Runs one simulation for every combination of similarity threshold, neighbors count and seed over a process pool.
+    # Every run stops once stable (see Schelling.run_until_stable) or after n_iterations iterations.
+    # Returns a table with the final similarity ratio, the iterations run and the Index of Dissimilarity of every run.
+    # The Index of Dissimilarity is only calculated for a given tract size (NaN without tract_rows), since tracts of one cell
+    # hold at most one agent and always give 1.
+    # A whole memory-mapped .npy grid (not a slice of it) is handed over to the workers as its file path
+    if (isinstance(data_grid, np.memmap) and str(data_grid.filename).endswith('.npy')
+            and np.load(data_grid.filename, mmap_mode='r').shape == data_grid.shape):
+        grid_source = str(data_grid.filename)
+    else:
+        grid_source = data_grid = np.asarray(data_grid)
+    if tract_rows is not None and (data_grid.shape[0] % tract_rows != 0 or data_grid.shape[1] % tract_cols != 0):
+        raise ValueError('Cannot split the data grid into tracts of %d rows and %d columns.' % (tract_rows, tract_cols))
+
+    # Runs are reproducible from their seed, so a repeated combination is only run once
+    runs = list(dict.fromkeys(itertools.product(similarity_thresholds, neighbors_counts, seeds)))
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=init_worker, initargs=(grid_source,)) as executor:
+        futures = [executor.submit(run_sweep_task, similarity_threshold, neighbors_count, seed, n_iterations, tolerance, patience,
+            engine, tract_rows, tract_cols)
+            for similarity_threshold, neighbors_count, seed in runs]
+        results = [future.result() for future in futures]
+
+    return pd.DataFrame(results, columns=SWEEP_COLUMNS)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweeps Schelling's segregation model over similarity thresholds, neighbors counts and seeds.")
+    parser.add_argument('--input', default='Input_data.csv', help='CSV or int8 .npy file path of the input data grid')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.4], help='similarity thresholds to run')
+    parser.add_argument('--neighbors', type=int, nargs='+', default=[3], help='neighbors counts to run')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help='random seeds to run')
+    parser.add_argument('--iterations', type=int, default=20, help='maximum number of iterations per run')
+    parser.add_argument('--tolerance', type=float, default=0., help='stops a run when the share of agents that moved or the change of the mean similarity ratio stays under it')
+    parser.add_argument('--patience', type=int, default=1, help='number of iterations in a row under the tolerance before a run stops')
+    parser.add_argument('--engine', choices=SCHELLING_ENGINES, default='vectorized', help='simulation engine')
+    parser.add_argument('--tract-rows', type=int, default=None, help='number of rows per tract for the Index of Dissimilarity (not calculated without it)')
+    parser.add_argument('--tract-cols', type=int, default=1, help='number of columns per tract for the Index of Dissimilarity')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--output', default='Sweep_results.csv', help='CSV file path of the results table')
+    args = parser.parse_args(argv)
+
+    try:
+        data_grid, column_names = open_grid(args.input, mmap_mode='r')
+    except (OSError, ValueError) as error:
+        sys.exit('Invalid path or csv file! %s' % error)
+
+    results = run_sweep(data_grid, args.thresholds, args.neighbors, args.seeds, args.iterations, args.tolerance, args.patience,
+        args.engine, args.tract_rows, args.tract_cols, args.workers)
+    results.to_csv(args.output, index=False)
+    print(results.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
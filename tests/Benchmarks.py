@@ -0,0 +1,225 @@
+import pytest
+import numpy as np
+# Imported by the tables of the models on first use, imported here so the import is not part of any timing
+import pandas as pd
+
+import os,sys,json,time,tracemalloc
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#####################################################################################
+# NOTE: Benchmarks are not part of the unit tests. Run them with:					#
+#		pytest -q ./tests/Benchmarks.py												#
+#		Every benchmark is compared with its baseline in Benchmark_baselines.json	#
+#		and fails when it is slower or uses more memory than the tolerance allows.	#
+#		Times are stored relative to a calibration workload timed in the same		#
+#		session, so the baselines hold on faster and slower machines.				#
+#		To record new baselines (e.g. after a speed-up), run:						#
+#		BENCHMARK_UPDATE_BASELINES=1 pytest -q ./tests/Benchmarks.py				#
+#		BENCHMARK_MAX_SIZE limits the size of the synthetic grids (default 2000).	#
+#####################################################################################
+
+# Sizes (rows and columns) and shares of empty cells of the synthetic data grids
+GRID_SIZES = [size for size in [50, 200, 1000, 2000] if size <= int(os.environ.get('BENCHMARK_MAX_SIZE', 2000))]
+VACANCY_RATES = [0.1, 0.3]
+
+# Per-cell Python loops (the reference engine and the reference similarity ratio scan) only run on the small grids
+REFERENCE_MAX_SIZE = 200
+
+# A benchmark fails when it takes longer than TIME_TOLERANCE times its baseline or when its peak memory is over
+# MEMORY_TOLERANCE times its baseline. The slacks keep very short or very small measurements from failing on noise.
+# Baseline times are in units of the calibration workload, they are converted to seconds on the machine running the benchmarks.
+BASELINES_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Benchmark_baselines.json')
+UPDATE_BASELINES = os.environ.get('BENCHMARK_UPDATE_BASELINES') == '1'
+TIME_TOLERANCE = float(os.environ.get('BENCHMARK_TIME_TOLERANCE', 2.))
+MEMORY_TOLERANCE = 1.25
+TIME_SLACK = 0.001
+MEMORY_SLACK = 1 << 16
+
+def create_grid(size, vacancy_rate, seed=0):
+	# Synthetic size x size int8 data grid with X (1) and O (-1) in equal shares and vacancy_rate empty cells (0)
+	rng = np.random.default_rng(seed)
+	return rng.choice(np.array([1, -1, 0], dtype=np.int8), size=(size, size), p=[(1 - vacancy_rate) / 2, (1 - vacancy_rate) / 2, vacancy_rate])
+
+def write_grid_csv(data_grid, csv_file_path):
+	# Writes a data grid as a CSV file of X, O and blank cells with Col<column-#> headers
+	cell_bytes = np.array([b'O', b'', b'X'], dtype=object)[data_grid + 1]
+	with open(csv_file_path, 'wb') as csv_file:
+		csv_file.write(','.join('Col' + str(col + 1) for col in range(data_grid.shape[1])).encode() + b'\n')
+		for row in cell_bytes:
+			csv_file.write(b','.join(row) + b'\n')
+
+def measure(run, setup=None, repeats=3, number=1):
+	# Gets the best time of repeats timings of number calls of run, and the peak memory allocated by one more call
+	# traced by tracemalloc (numpy allocations included). setup is called before every timing, without being timed,
+	# and its result is passed to run.
+	timings = []
+	for repeat in range(repeats):
+		state = setup() if setup is not None else None
+		start = time.perf_counter()
+		for call in range(number):
+			run(state)
+		timings.append((time.perf_counter() - start) / number)
+
+	state = setup() if setup is not None else None
+	tracemalloc.start()
+	try:
+		run(state)
+		peak_memory = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+	return [min(timings), peak_memory]
+
+def calibrate(repeats=5):
+	# Gets the best time of a fixed workload of numpy array operations and of a Python loop, like the benchmarked code
+	data = np.random.default_rng(0).random((1000, 1000))
+	timings = []
+	for repeat in range(repeats):
+		start = time.perf_counter()
+		np.cumsum(np.cumsum(data, axis=0), axis=1)
+		np.sort(data, axis=1)
+		sum(value * value for value in range(200000))
+		timings.append(time.perf_counter() - start)
+
+	return min(timings)
+
+# Fixtures
+@pytest.fixture(scope='session')
+def benchmark_baselines():
+	# Baselines of all benchmarks, saved again at the end of the session when they are being updated
+	baselines = {}
+	if os.path.exists(BASELINES_FILE_PATH):
+		with open(BASELINES_FILE_PATH) as baselines_file:
+			baselines = json.load(baselines_file)
+
+	yield baselines
+
+	if UPDATE_BASELINES:
+		with open(BASELINES_FILE_PATH, 'w') as baselines_file:
+			json.dump(baselines, baselines_file, indent=1, sort_keys=True)
+
+@pytest.fixture(scope='session')
+def calibration_seconds():
+	# Time of the calibration workload on this machine, the unit of the baseline times
+	return calibrate()
+
+@pytest.fixture
+def check_baseline(request, benchmark_baselines, calibration_seconds):
+	# Compares the time and peak memory of a benchmark with its baseline, or records them as its new baseline
+	def check(seconds, peak_memory):
+		print('\n%s: %.6f s (%.3f calibrations), %.1f MiB peak' % (request.node.name, seconds, seconds / calibration_seconds, peak_memory / (1 << 20)))
+		if UPDATE_BASELINES:
+			benchmark_baselines[request.node.name] = {'relative_time': seconds / calibration_seconds, 'peak_memory': peak_memory}
+			return
+
+		baseline = benchmark_baselines.get(request.node.name)
+		if baseline is None:
+			pytest.skip('No baseline for %s, run with BENCHMARK_UPDATE_BASELINES=1 to record it.' % request.node.name)
+
+		baseline_seconds = baseline['relative_time'] * calibration_seconds
+		assert seconds <= baseline_seconds * TIME_TOLERANCE + TIME_SLACK, \
+			'%.6f s is slower than the baseline of %.6f s on this machine' % (seconds, baseline_seconds)
+		assert peak_memory <= baseline['peak_memory'] * MEMORY_TOLERANCE + MEMORY_SLACK, \
+			'%d bytes is more than the baseline of %d bytes' % (peak_memory, baseline['peak_memory'])
+
+	return check
+
+@pytest.fixture(scope='module')
+def grid_csv_files(tmp_path_factory):
+	# CSV file of every synthetic data grid, written once for all the ingestion benchmarks
+	csv_files = {}
+	for size in GRID_SIZES:
+		for vacancy_rate in VACANCY_RATES:
+			csv_file_path = str(tmp_path_factory.mktemp('grids') / ('grid_%d_%s.csv' % (size, vacancy_rate)))
+			write_grid_csv(create_grid(size, vacancy_rate), csv_file_path)
+			csv_files[size, vacancy_rate] = csv_file_path
+
+	return csv_files
+
+##############################
+# Schelling Class Benchmarks #
+##############################
+@pytest.mark.parametrize('vacancy_rate', VACANCY_RATES)
+@pytest.mark.parametrize('size', GRID_SIZES)
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled', 'tiled'])
+def test_run_simulation(check_baseline, engine, size, vacancy_rate):
+	from Schelling import Schelling as SchellingModel
+	import SchellingKernel
+
+	if engine == 'reference' and size > REFERENCE_MAX_SIZE:
+		pytest.skip('The reference engine is only benchmarked up to %dx%d.' % (REFERENCE_MAX_SIZE, REFERENCE_MAX_SIZE))
+	if engine == 'compiled' and not SchellingKernel.NUMBA_AVAILABLE:
+		# The baselines are for the numba kernel, without numba the compiled engine is the reference loop
+		pytest.skip('The compiled engine is only benchmarked with numba installed.')
+
+	# One iteration from the same starting grid and seed every time. Creating the model is not timed.
+	data_grid = create_grid(size, vacancy_rate)
+	check_baseline(*measure(lambda schelling: schelling.run_simulation(),
+		lambda: SchellingModel(data_grid.copy(), 0.5, 3, engine, warm_up=True, seed=0)))
+
+@pytest.mark.parametrize('vacancy_rate', VACANCY_RATES)
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_create_model(check_baseline, size, vacancy_rate):
+	from Schelling import Schelling as SchellingModel
+
+	# Counting the neighbors of every cell once, before the first iteration
+	data_grid = create_grid(size, vacancy_rate)
+	check_baseline(*measure(lambda state: SchellingModel(data_grid.copy(), 0.5, 3, 'vectorized')))
+
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_get_average_similarity_ratio(check_baseline, size):
+	from Schelling import Schelling as SchellingModel
+
+	schelling = SchellingModel(create_grid(size, 0.1), 0.5, 3, 'vectorized')
+	check_baseline(*measure(lambda state: schelling.get_average_similarity_ratio(), number=1000))
+
+@pytest.mark.parametrize('size', [size for size in GRID_SIZES if size <= REFERENCE_MAX_SIZE])
+def test_calculate_average_similarity_ratio(check_baseline, size):
+	from Schelling import Schelling as SchellingModel
+
+	# The original scan of every neighborhood, for comparison with the running sum above
+	schelling = SchellingModel(create_grid(size, 0.1), 0.5, 3, 'vectorized')
+	check_baseline(*measure(lambda state: schelling.calculate_average_similarity_ratio(), repeats=1))
+
+##################################
+# Dissimilarity Class Benchmarks #
+##################################
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_get_splitted_data_and_partial_indices(check_baseline, size):
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	# 100 tracts of size/10 x size/10 cells, each with its own partial index
+	dissimilarity = DissimilaritySegregationModel(create_grid(size, 0.1))
+	check_baseline(*measure(lambda state: [dissimilarity.calculate_partial_index(tract)
+		for tract in dissimilarity.get_splitted_data(size // 10, size // 10)]))
+
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_calculate_dissimilarity_index(check_baseline, size):
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	data_grid = create_grid(size, 0.1)
+	check_baseline(*measure(lambda state: DissimilaritySegregationModel(data_grid).calculate_dissimilarity_index(size // 10, size // 10)))
+
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_get_multiscale_dissimilarity(check_baseline, size):
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	data_grid = create_grid(size, 0.1)
+	check_baseline(*measure(lambda state: DissimilaritySegregationModel(data_grid).get_multiscale_dissimilarity(), repeats=1))
+
+##########################
+# Grid Loader Benchmarks #
+##########################
+@pytest.mark.parametrize('vacancy_rate', VACANCY_RATES)
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_load_grid(check_baseline, grid_csv_files, size, vacancy_rate):
+	from GridLoader import load_grid
+
+	check_baseline(*measure(lambda state: load_grid(grid_csv_files[size, vacancy_rate])))
+
+@pytest.mark.parametrize('size', GRID_SIZES)
+def test_convert_csv_to_npy(check_baseline, grid_csv_files, tmp_path, size):
+	from GridLoader import convert_csv_to_npy
+
+	# Streamed in blocks of 1 MiB, the peak memory depends on the block size rather than on the size of the grid
+	check_baseline(*measure(lambda state: convert_csv_to_npy(grid_csv_files[size, 0.1], str(tmp_path / 'grid.npy'), chunk_size=1 << 20)))
@@ -14,63 +14,25 @@ def dissimilarity_seg_model():
 
 	return DissimilaritySegregationModel(raw_test_input_data)
 
+@pytest.fixture
+def numeric_test_input_data():
+	# 6x6 numeric matrix (1 - X, -1 is O and 0 is blank/empty)
+	return pd.read_csv('./tests/Converted_to_numeric_input_test_data.csv')
+
 @pytest.fixture
 def application_main():
 	import App as app
 
 	return app
 
-###################################################################################
-# NOTE: Schelling class cannot be tested since we are using random library in it. #
-#		There will be no fixed result to be expected from	.					  #
-###################################################################################
+#####################################################################################
+# NOTE: Schelling moves are random. They are tested by seeding the model so that the #
+#		same seed always gives the same moves.										#
+#####################################################################################
 
 ##################
 # Main app tests #
 ##################
-def test_main_app_count_char(application_main):
-	# Expected values
-	expected_X_char_count = 15
-	expected_O_char_count = 14
-	expected_blank_char_count = 7
-
-	# Actual values
-	raw_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
-	X_char_count = application_main.count_char(raw_test_input_data.values, 'X')
-	O_char_count = application_main.count_char(raw_test_input_data.values, 'O')
-	empty_char_count = application_main.count_char(raw_test_input_data.values, '')
-
-	# Assertions
-	assert X_char_count == expected_X_char_count
-	assert O_char_count == expected_O_char_count
-	assert empty_char_count == expected_blank_char_count
-
-def test_main_app_count_char2(application_main):
-	# Expected values
-	expected_X_char_count = 12
-	expected_O_char_count = 15
-	expected_blank_char_count = 9
-
-	# Actual values
-	raw_test_input_data = pd.read_csv('./tests/Input_test_data_2.csv').fillna('')
-	X_char_count = application_main.count_char(raw_test_input_data.values, 'X')
-	O_char_count = application_main.count_char(raw_test_input_data.values, 'O')
-	empty_char_count = application_main.count_char(raw_test_input_data.values, '')
-
-	# Assertions
-	assert X_char_count == expected_X_char_count
-	assert O_char_count == expected_O_char_count
-	assert empty_char_count == expected_blank_char_count
-
-def test_validate_data_for_invalid_chars(application_main):
-	# Valid input test data (no characters other than X, O and blank/empty)
-	raw_test_input_valid_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
-	assert application_main.validate_data_for_invalid_chars(raw_test_input_valid_data) == True
-
-	# Invalid input test data (with characters other than X, O and blank/empty)
-	raw_test_input_invalid_data = pd.read_csv('./tests/Input_test_invalid_data.csv').fillna('')
-	assert application_main.validate_data_for_invalid_chars(raw_test_input_invalid_data) == False
-
 def test_validate_row_column_inputs(application_main):
 	# Test data is 6x6 matrix
 	raw_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
@@ -88,21 +50,38 @@ def test_validate_row_column_inputs(application_main):
 	assert application_main.validate_row_column_inputs(raw_test_input_data, 9, 4)[1] == 'CANT_SPLIT'
 
 
-def test_convert_char_seq_to_numeric_grid(application_main):
-	# Test input data is 6x6 character matrix
-	character_seq_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
+def test_load_input_grid(application_main, numeric_test_input_data):
+	input_file_stat = os.stat('./tests/Input_test_data.csv')
+	file_hash = application_main.get_file_hash('./tests/Input_test_data.csv', input_file_stat.st_mtime, input_file_stat.st_size)
+	assert file_hash != application_main.get_file_hash('./tests/Input_test_invalid_data.csv', input_file_stat.st_mtime, input_file_stat.st_size)
 
-	# Converted test data to 6x6 numeric matrix (1 - X, -1 is O and 0 is blank/empty)
-	numeric_test_input_data = pd.read_csv('./tests/Converted_to_numeric_input_test_data.csv').fillna('')
-	assert application_main.convert_char_seq_to_numeric_grid(character_seq_test_input_data).equals(numeric_test_input_data)
+	# The cached grid is shared by all reruns, so it cannot be changed
+	input_grid, column_names = application_main.load_input_grid('./tests/Input_test_data.csv', file_hash)
+	assert (input_grid == numeric_test_input_data.values).all()
+	assert not input_grid.flags.writeable
+	assert application_main.load_input_grid('./tests/Input_test_data.csv', file_hash)[0] is input_grid
 
-def test_convert_numeric_grid_to_char_seq_grid(application_main):
-	# Test input data of 6x6 numeric matrix
-	numeric_test_data = pd.read_csv('./tests/Converted_to_numeric_input_test_data.csv').fillna('')
+def test_simulation_thread(application_main, numeric_test_input_data, tmp_path):
+	from Schelling import Schelling as SchellingModel
+	from Checkpoint import load_checkpoint
 
-	# Converted test datato 6x6 character matrix (1 - X, -1 is O and 0 is blank/empty)
-	character_seq_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
-	assert application_main.convert_numeric_grid_to_char_seq_grid(numeric_test_data).equals(character_seq_test_input_data)
+	# No agent can ever be satisfied with a threshold above 1, so all the 6 iterations run
+	schelling = SchellingModel(numeric_test_input_data.values.astype(np.int8), 1.1, 2, 'vectorized', seed=0)
+	simulation = application_main.SimulationThread(schelling, 6, 0., render_every=4, checkpoint_file_path=str(tmp_path / 'checkpoint.npz'))
+	simulation.start()
+	simulation.join()
+
+	# A frame for iteration 4 and one after the last iteration, each with its own copy of the data grid
+	frames = [simulation.frames.get_nowait() for i in range(simulation.frames.qsize())]
+	assert [iterations for iterations, data_grid, similarity_history, metrics_records in frames] == [4, 6]
+	assert (frames[-1][1] == schelling.data_grid).all() and frames[0][1] is not schelling.data_grid
+	assert len(frames[-1][2]) == 7
+	assert simulation.stop_reason == 'MAX_ITERATIONS' and simulation.error is None
+
+	# The checkpoint of the last iteration is written by the checkpoint writer before the simulation thread ends
+	assert not simulation.checkpoint_writer.is_alive()
+	resumed = load_checkpoint(str(tmp_path / 'checkpoint.npz'))
+	assert resumed.iterations == 6 and (resumed.data_grid == schelling.data_grid).all()
 
 #############################
 # Dissimilarity Class Tests #
@@ -119,6 +98,75 @@ def test_get_splitted_data(dissimilarity_seg_model):
 		[['X','O','X'],['X','O','X'],['','','']]]
 	assert (dissimilarity_seg_model.get_splitted_data(3, 3) == np.array(expected_tracts_array)).all()
 
+def test_get_splitted_data_non_square():
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	# 2x6 data grid splitted to 1x3 tracts gives 2 tracts per row
+	raw_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('').iloc[0:2]
+	expected_tracts_array = [[['X','X','O']], [['O','X','']], [['X','O','O']], [['X','O','']]]
+	assert (DissimilaritySegregationModel(raw_test_input_data).get_splitted_data(1, 3) == np.array(expected_tracts_array)).all()
+
+def test_calculate_dissimilarity_index(dissimilarity_seg_model):
+	# Same result as calculating the partial index of every tract one by one
+	for nrows, ncols in [(1, 1), (2, 3), (3, 2), (3, 3), (6, 6)]:
+		D, partial_indices = dissimilarity_seg_model.calculate_dissimilarity_index(nrows, ncols)
+		expected_partial_indices = [dissimilarity_seg_model.calculate_partial_index(data_per_tract)
+			for data_per_tract in dissimilarity_seg_model.get_splitted_data(nrows, ncols)]
+		assert partial_indices == pytest.approx(expected_partial_indices)
+		assert D == pytest.approx(0.5*sum(expected_partial_indices))
+
+	# For 3x3 Tracts from the original 6x6 data grid
+	assert round(dissimilarity_seg_model.calculate_dissimilarity_index(3, 3)[0], 2) == 0.17
+
+def test_dissimilarity_with_numeric_grid(dissimilarity_seg_model, numeric_test_input_data):
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	# The compact numeric grid gives the same result as the grid of characters
+	dissimilarity = DissimilaritySegregationModel(numeric_test_input_data.values.astype(np.int8))
+	assert dissimilarity.total_X_count == 15 and dissimilarity.total_O_count == 14
+	assert dissimilarity.calculate_dissimilarity_index(3, 3)[0] == pytest.approx(dissimilarity_seg_model.calculate_dissimilarity_index(3, 3)[0])
+	assert round(dissimilarity.calculate_partial_index(dissimilarity.get_splitted_data(3, 3)[0]), 2) == 0.05
+
+def test_dissimilarity_with_memory_mapped_grid(dissimilarity_seg_model, numeric_test_input_data, tmp_path, monkeypatch):
+	import GridLoader
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	# Tiles of 1 row (6 cells), so the tracts of 3 rows are counted over several tiles
+	monkeypatch.setattr(GridLoader, 'TILE_CELLS', 6)
+	np.save(str(tmp_path / 'grid.npy'), numeric_test_input_data.values.astype(np.int8))
+	dissimilarity = DissimilaritySegregationModel(np.load(str(tmp_path / 'grid.npy'), mmap_mode='r'))
+	assert dissimilarity.total_X_count == 15 and dissimilarity.total_O_count == 14
+	assert dissimilarity.calculate_dissimilarity_index(3, 3)[0] == pytest.approx(dissimilarity_seg_model.calculate_dissimilarity_index(3, 3)[0])
+	assert dissimilarity.calculate_window_dissimilarity_index(3, 3)[0] == pytest.approx(dissimilarity_seg_model.calculate_window_dissimilarity_index(3, 3)[0])
+
+	# Tracts of memory-mapped grids are counted tile by tile, without the prefix sum tables
+	D, partial_indices = dissimilarity.calculate_window_dissimilarity_index(2, 2, 1, 1)
+	assert not hasattr(dissimilarity, 'prefix_sum_tables')
+	assert D == pytest.approx(dissimilarity_seg_model.calculate_window_dissimilarity_index(2, 2, 1, 1)[0])
+	assert partial_indices == pytest.approx(dissimilarity_seg_model.calculate_window_dissimilarity_index(2, 2, 1, 1)[1])
+
+def test_get_multiscale_dissimilarity(dissimilarity_seg_model):
+	multiscale_dissimilarity = dissimilarity_seg_model.get_multiscale_dissimilarity()
+
+	# Divisors of 6 are 1, 2, 3 and 6 so there are 4x4 tract sizes
+	assert len(multiscale_dissimilarity) == 16
+	for nrows, ncols, D in multiscale_dissimilarity[['tract_rows', 'tract_cols', 'dissimilarity_index']].values:
+		assert D == pytest.approx(dissimilarity_seg_model.calculate_dissimilarity_index(int(nrows), int(ncols))[0])
+
+def test_calculate_window_dissimilarity_index(dissimilarity_seg_model):
+	from Dissimilarity import Dissimilarity as DissimilaritySegregationModel
+
+	# 2x2 tracts tiled from row 1 and column 1 cover the 4x4 data grid in the middle of the original 6x6 data grid
+	D, partial_indices = dissimilarity_seg_model.calculate_window_dissimilarity_index(2, 2, 1, 1)
+	middle_data_grid = DissimilaritySegregationModel(dissimilarity_seg_model.input_data.iloc[1:5, 1:5])
+	assert partial_indices.shape == (2, 2)
+	assert D == pytest.approx(middle_data_grid.calculate_dissimilarity_index(2, 2)[0])
+
+	# Every offset of 3x3 tracts
+	sliding_window_dissimilarity = dissimilarity_seg_model.get_sliding_window_dissimilarity(3, 3)
+	assert len(sliding_window_dissimilarity) == 9
+	assert sliding_window_dissimilarity['dissimilarity_index'][0] == pytest.approx(0.17142857142857143)
+
 def test_calculate_partial_index(dissimilarity_seg_model):
 	expected_partial_index = 0.07
 	# For 2x2 Tract from the original 6x6 data grid
@@ -147,4 +195,370 @@ def test_count_char(dissimilarity_seg_model):
 	assert X_char_count == expected_X_char_count
 	assert O_char_count == expected_O_char_count
 	assert blank_char_count == expected_blank_char_count
-	
\ No newline at end of file
+
+#########################
+# Schelling Class Tests #
+#########################
+def test_similarity_ratio_matches_reference(numeric_test_input_data):
+	from Schelling import Schelling as SchellingModel
+
+	# The neighbor count fields should rate every neighborhood size like the reference scan, including the edge cells
+	for neighbors_count in range(1, 4):
+		schelling = SchellingModel(numeric_test_input_data.copy(), 0.4, neighbors_count, 'vectorized')
+		assert schelling.get_average_similarity_ratio() == pytest.approx(schelling.calculate_average_similarity_ratio())
+
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled'])
+def test_neighbor_counts_follow_moves(numeric_test_input_data, engine):
+	from Schelling import Schelling as SchellingModel
+
+	schelling = SchellingModel(numeric_test_input_data.copy(), 0.8, 2, engine)
+	for i in range(3):
+		schelling.run_simulation()
+
+	# The running similarity ratio and the updated neighbor counts should match a recount of the new data grid
+	recounted = SchellingModel(pd.DataFrame(schelling.data_grid.copy()), 0.8, 2, engine)
+	assert schelling.get_average_similarity_ratio() == pytest.approx(schelling.calculate_average_similarity_ratio())
+	assert (schelling.X_counts == recounted.X_counts).all()
+	assert (schelling.O_counts == recounted.O_counts).all()
+
+def test_neighbor_counts(numeric_test_input_data):
+	from Schelling import Schelling as SchellingModel
+
+	schelling = SchellingModel(numeric_test_input_data.copy(), 0.4, 2, 'vectorized')
+	like_counts, occupied_counts = schelling.get_neighbor_counts()
+
+	# Neighborhood of the cell at row 3, column 3 is the 4x4 slice [1:5, 1:5] which holds 8 X and 7 O
+	assert like_counts[3, 3] == 8
+	assert occupied_counts[3, 3] == 15
+
+def test_vectorized_simulation_keeps_population(numeric_test_input_data):
+	from Schelling import Schelling as SchellingModel
+
+	schelling = SchellingModel(numeric_test_input_data.copy(), 0.8, 2, 'vectorized')
+	schelling.run_simulation()
+
+	# Agents only move around so the number of X, O and empty cells stays the same
+	assert np.count_nonzero(schelling.data_grid == 1) == 15
+	assert np.count_nonzero(schelling.data_grid == -1) == 14
+	assert np.count_nonzero(schelling.data_grid == 0) == 7
+
+def test_unknown_engine(numeric_test_input_data):
+	from Schelling import Schelling as SchellingModel
+
+	with pytest.raises(ValueError):
+		SchellingModel(numeric_test_input_data, 0.4, 3, 'unknown')
+
+def test_empty_cell_index(numeric_test_input_data):
+	from Schelling import EmptyCellIndex
+
+	data_grid = numeric_test_input_data.values
+	empty_cells = EmptyCellIndex(data_grid)
+	assert sorted(empty_cells.get_cells()) == list(np.flatnonzero(data_grid == 0))
+
+	# Cell 5 gets occupied by the agent from cell 0
+	empty_cells.move(5, 0)
+	assert 5 not in empty_cells and 0 in empty_cells
+	assert len(empty_cells) == 7
+
+	# Swap-remove keeps the remaining cells packed at the front of the index
+	empty_cells.remove(0)
+	empty_cells.add(1)
+	assert sorted(empty_cells.get_cells()) == [1, 11, 15, 32, 33, 34, 35]
+	assert empty_cells.sample(0.5) in empty_cells
+
+def test_compiled_engine_matches_reference(numeric_test_input_data):
+	from Schelling import Schelling as SchellingModel
+
+	# Both engines use the same sequential update and the same random draws, so the same seed gives the same data grid
+	reference = SchellingModel(numeric_test_input_data.copy(), 0.7, 2, 'reference', seed=7)
+	compiled = SchellingModel(numeric_test_input_data.copy(), 0.7, 2, 'compiled', warm_up=True, seed=7)
+	for i in range(3):
+		reference.run_simulation()
+		compiled.run_simulation()
+		assert (compiled.data_grid == reference.data_grid).all()
+		assert compiled.get_average_similarity_ratio() == pytest.approx(reference.get_average_similarity_ratio())
+
+@pytest.mark.parametrize('engine', ['reference', 'compiled'])
+def test_full_grid_has_no_empty_cell(engine):
+	from Schelling import Schelling as SchellingModel
+
+	# Unsatisfied agents of a grid without empty cells have nowhere to move, no agent may be lost
+	data_grid = np.array([[1, -1, 1, -1], [-1, 1, -1, 1], [1, -1, 1, -1], [-1, 1, -1, 1]], dtype=np.int8)
+	schelling = SchellingModel(data_grid, 0.9, 2, engine, warm_up=True, seed=0)
+	with pytest.raises(IndexError):
+		schelling.run_simulation()
+	assert np.count_nonzero(data_grid == 0) == 0
+
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled'])
+def test_seeded_runs_are_reproducible(numeric_test_input_data, engine):
+	from Schelling import Schelling as SchellingModel
+
+	# A seed and a numpy Generator created from that seed give the same moves
+	seeded = SchellingModel(numeric_test_input_data.copy(), 0.7, 2, engine, seed=3)
+	generator = SchellingModel(numeric_test_input_data.copy(), 0.7, 2, engine, seed=np.random.default_rng(3))
+	for i in range(3):
+		seeded.run_simulation()
+		generator.run_simulation()
+
+	assert (seeded.data_grid == generator.data_grid).all()
+	assert not (seeded.data_grid == numeric_test_input_data.values).all()
+
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled'])
+def test_run_until_stable(numeric_test_input_data, engine):
+	from Schelling import Schelling as SchellingModel
+
+	# Every agent is satisfied with a threshold of 0, so the first iteration moves nobody
+	schelling = SchellingModel(numeric_test_input_data.copy(), 0., 2, engine, seed=0)
+	assert schelling.run_until_stable(10) == [1, 'NO_MOVES']
+
+	# No agent can ever be satisfied with a threshold above 1, so the run goes on until the maximum number of iterations
+	schelling = SchellingModel(numeric_test_input_data.copy(), 1.1, 2, engine, seed=0)
+	moves_counts = []
+	assert schelling.run_until_stable(4, callback=lambda model, moves_count: moves_counts.append(moves_count)) == [4, 'MAX_ITERATIONS']
+	assert len(moves_counts) == 4 and min(moves_counts) > 0
+	assert schelling.iterations == 4
+	assert len(schelling.similarity_history) == 5
+
+	# Everybody keeps moving, but the share of agents that moved is under a tolerance above 100%
+	schelling = SchellingModel(numeric_test_input_data.copy(), 1.1, 2, engine, seed=0)
+	assert schelling.run_until_stable(10, tolerance=1.5, patience=2) == [2, 'FEW_MOVES']
+
+def test_tiled_engine_on_memory_mapped_grid(numeric_test_input_data, tmp_path, monkeypatch):
+	import GridLoader
+	from Schelling import Schelling as SchellingModel
+
+	# Tiles of 2 rows (12 cells), so the 6x6 grid is scanned in 3 tiles whose neighborhoods overlap
+	monkeypatch.setattr(GridLoader, 'TILE_CELLS', 12)
+	data_grid = np.lib.format.open_memmap(str(tmp_path / 'grid.npy'), mode='w+', dtype=np.int8, shape=(6, 6))
+	data_grid[:] = numeric_test_input_data.values
+
+	schelling = SchellingModel(data_grid, 0.8, 2, 'tiled', seed=0)
+	vectorized = SchellingModel(numeric_test_input_data.copy(), 0.8, 2, 'vectorized')
+	assert schelling.get_average_similarity_ratio() == pytest.approx(vectorized.get_average_similarity_ratio())
+	assert (schelling.get_similarity_ratios()[0] == vectorized.get_similarity_ratios()[0]).all()
+
+	# Moves are written straight to the memory-mapped file and the running similarity ratio follows them
+	assert schelling.run_simulation() > 0
+	assert schelling.get_average_similarity_ratio() == pytest.approx(schelling.calculate_average_similarity_ratio())
+	assert (np.load(str(tmp_path / 'grid.npy')) == schelling.data_grid).all()
+	assert np.count_nonzero(schelling.data_grid == 0) == 7
+
+	# Unsatisfied agents are marked in the grid while they move, no mark is left after the iteration
+	assert np.isin(schelling.data_grid, (-1, 0, 1)).all()
+	assert np.count_nonzero(schelling.data_grid == 1) == 15 and np.count_nonzero(schelling.data_grid == -1) == 14
+
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled', 'tiled'])
+def test_iteration_metrics(numeric_test_input_data, tmp_path, engine):
+	from Schelling import Schelling as SchellingModel
+	from Metrics import IterationMetrics, METRICS_FIELDS
+
+	records = []
+	metrics = IterationMetrics(callback=records.append)
+	schelling = SchellingModel(numeric_test_input_data.values.astype(np.int8), 0.7, 2, engine, seed=0, metrics=metrics)
+	moves_counts = [schelling.run_simulation() for i in range(3)]
+
+	# One record per iteration, also passed to the callback
+	assert records == metrics.records
+	assert [record['iteration'] for record in records] == [1, 2, 3]
+	assert [record['moves_count'] for record in records] == moves_counts
+	assert all(record['unsatisfied_count'] >= record['moves_count'] and record['empty_cells_count'] == 7 for record in records)
+	assert [record['similarity_ratio'] for record in records] == schelling.similarity_history[1:]
+	assert all(record['evaluation_seconds'] + record['move_seconds'] + record['update_seconds'] <= record['iteration_seconds'] for record in records)
+
+	# Exported with one row or object per iteration
+	metrics.to_csv(str(tmp_path / 'metrics.csv'))
+	metrics.to_json(str(tmp_path / 'metrics.json'))
+	assert list(pd.read_csv(str(tmp_path / 'metrics.csv')).columns) == METRICS_FIELDS
+	assert len(pd.read_json(str(tmp_path / 'metrics.json'))) == 3
+
+####################
+# Checkpoint Tests #
+####################
+@pytest.mark.parametrize('engine', ['reference', 'vectorized', 'compiled', 'tiled'])
+def test_resume_from_checkpoint(numeric_test_input_data, tmp_path, engine):
+	from Schelling import Schelling as SchellingModel
+	from Checkpoint import save_checkpoint, load_checkpoint
+
+	schelling = SchellingModel(numeric_test_input_data.values.astype(np.int8), 0.7, 2, engine, seed=5)
+	schelling.run_until_stable(2)
+	save_checkpoint(schelling, str(tmp_path / 'checkpoint.npz'))
+	schelling.run_until_stable(3)
+
+	# A resumed run gives the same moves as the run that went on without stopping
+	resumed = load_checkpoint(str(tmp_path / 'checkpoint.npz'))
+	assert resumed.engine == engine and resumed.iterations == 2
+	resumed.run_until_stable(3)
+	assert (resumed.data_grid == schelling.data_grid).all()
+	assert resumed.iterations == 5
+	assert resumed.similarity_history == pytest.approx(schelling.similarity_history)
+
+def test_replay_trajectory(numeric_test_input_data, tmp_path):
+	from Schelling import Schelling as SchellingModel
+	from Checkpoint import TrajectoryLog, replay_trajectory, save_checkpoint, load_checkpoint
+
+	schelling = SchellingModel(numeric_test_input_data.values.astype(np.int8), 0.7, 2, 'reference', seed=5)
+	trajectory_log = TrajectoryLog(str(tmp_path / 'trajectory.npy'), schelling)
+	data_grids = [schelling.data_grid.copy()]
+	for i in range(4):
+		schelling.run_simulation()
+		trajectory_log.record(schelling)
+		data_grids.append(schelling.data_grid.copy())
+		if i == 1:
+			save_checkpoint(schelling, str(tmp_path / 'checkpoint.npz'))
+
+	# Every data grid of the run is replayed from the move deltas
+	replayed = [[iteration, data_grid.copy()] for iteration, data_grid in replay_trajectory(str(tmp_path / 'trajectory.npy'))]
+	assert [iteration for iteration, data_grid in replayed] == [0, 1, 2, 3, 4]
+	assert all((data_grid == expected).all() for (iteration, data_grid), expected in zip(replayed, data_grids))
+
+	# Resuming from the checkpoint of iteration 2 drops the records after it from the trajectory
+	resumed = load_checkpoint(str(tmp_path / 'checkpoint.npz'))
+	TrajectoryLog(str(tmp_path / 'trajectory.npy'), resumed)
+	assert len(list(replay_trajectory(str(tmp_path / 'trajectory.npy')))) == 3
+
+	# The trajectory of another run is not resumed, and a new run starts a new file
+	other = SchellingModel(numeric_test_input_data.values.astype(np.int8)[::-1].copy(), 0.7, 2, 'reference', seed=5)
+	other.run_simulation()
+	with pytest.raises(ValueError):
+		TrajectoryLog(str(tmp_path / 'trajectory.npy'), other)
+	other = SchellingModel(numeric_test_input_data.values.astype(np.int8)[::-1].copy(), 0.7, 2, 'reference', seed=5)
+	TrajectoryLog(str(tmp_path / 'trajectory.npy'), other)
+	replayed = list(replay_trajectory(str(tmp_path / 'trajectory.npy')))
+	assert len(replayed) == 1 and (replayed[0][1] == other.data_grid).all()
+
+######################
+# Sweep Runner Tests #
+######################
+def test_run_sweep(numeric_test_input_data):
+	from Sweep import run_sweep
+
+	results = run_sweep(numeric_test_input_data.values, [0.3, 0.6], [2], [0, 1], n_iterations=5, tract_rows=3, tract_cols=3, max_workers=2)
+
+	# One row per combination of similarity threshold, neighbors count and seed
+	assert len(results) == 4
+	assert list(results['seed']) == [0, 1, 0, 1]
+	assert (results['iterations'] <= 5).all()
+	assert results['dissimilarity_index'].between(0, 1).all()
+
+	# Runs with the same seed are reproducible
+	assert results.equals(run_sweep(numeric_test_input_data.values, [0.3, 0.6], [2], [0, 1], n_iterations=5, tract_rows=3, tract_cols=3, max_workers=2))
+
+	# Without a tract size the Index of Dissimilarity is not calculated
+	results = run_sweep(numeric_test_input_data.values, [0.3], [2], [0], n_iterations=5, max_workers=1)
+	assert results['dissimilarity_index'].isna().all()
+
+######################
+# Command Line Tests #
+######################
+def test_cli_dissimilarity(dissimilarity_seg_model, tmp_path):
+	import json
+	from Cli import main
+
+	main(['--input', './tests/Input_test_data.csv', '--output', str(tmp_path / 'results.json'), 'dissimilarity', '--tract-rows', '3', '--tract-cols', '3'])
+	with open(str(tmp_path / 'results.json')) as results_file:
+		results = json.load(results_file)
+	assert results[0]['tracts_count'] == 4
+	assert results[0]['dissimilarity_index'] == pytest.approx(dissimilarity_seg_model.calculate_dissimilarity_index(3, 3)[0])
+
+	# Every tract size as CSV, 6 rows and 6 columns have 4 divisors each
+	main(['--input', './tests/Input_test_data.csv', '--output', str(tmp_path / 'results.csv'), 'dissimilarity', '--all-tract-sizes'])
+	assert len(pd.read_csv(str(tmp_path / 'results.csv'))) == 16
+
+def test_cli_schelling(numeric_test_input_data, tmp_path):
+	from Cli import main
+	from GridLoader import load_grid
+
+	main(['--input', './tests/Input_test_data.csv', '--output', str(tmp_path / 'results.csv'), 'schelling', '--threshold', '0.7',
+		'--neighbors', '2', '--iterations', '3', '--engine', 'reference', '--seed', '5', '--tract-rows', '3', '--tract-cols', '3',
+		'--output-grid', str(tmp_path / 'grid.csv'), '--metrics', str(tmp_path / 'metrics.csv'), '--checkpoint', str(tmp_path / 'checkpoint.npz')])
+	results = pd.read_csv(str(tmp_path / 'results.csv'))
+	assert results['iterations'][0] <= 3 and results['dissimilarity_index'].between(0, 1).all()
+	assert len(pd.read_csv(str(tmp_path / 'metrics.csv'))) == results['iterations'][0]
+
+	# The final data grid is saved like the input file, with the same agents
+	data_grid, column_names = load_grid(str(tmp_path / 'grid.csv'))
+	assert column_names == ['Col1', 'Col2', 'Col3', 'Col4', 'Col5', 'Col6']
+	assert np.count_nonzero(data_grid == 1) == 15 and np.count_nonzero(data_grid == -1) == 14
+
+	# A run resumed from the checkpoint goes on up to the new number of iterations
+	main(['--input', './tests/Input_test_data.csv', '--output', str(tmp_path / 'resumed.json'), 'schelling', '--iterations', '5',
+		'--resume', str(tmp_path / 'checkpoint.npz')])
+	resumed = pd.read_json(str(tmp_path / 'resumed.json'))
+	assert resumed['engine'][0] == 'reference' and resumed['similarity_threshold'][0] == pytest.approx(0.7)
+	assert results['iterations'][0] <= resumed['iterations'][0] <= 5
+
+#####################
+# Grid Loader Tests #
+#####################
+def test_load_grid(numeric_test_input_data):
+	from GridLoader import load_grid
+
+	# 6x6 character matrix loaded straight as a compact 6x6 numeric matrix (1 - X, -1 is O and 0 is blank/empty)
+	data_grid, column_names = load_grid('./tests/Input_test_data.csv')
+	assert data_grid.dtype == np.int8
+	assert (data_grid == numeric_test_input_data.values).all()
+	assert column_names == ['Col1', 'Col2', 'Col3', 'Col4', 'Col5', 'Col6']
+
+	# Invalid input test data (with characters other than X, O and blank/empty)
+	with pytest.raises(ValueError):
+		load_grid('./tests/Input_test_invalid_data.csv')
+
+	# Blocks of 20 bytes hold about one row, so the rows are parsed over several blocks into the same grid
+	assert (load_grid('./tests/Input_test_data.csv', chunk_size=20)[0] == numeric_test_input_data.values).all()
+	with pytest.raises(ValueError):
+		load_grid('./tests/Input_test_invalid_data.csv', chunk_size=20)
+
+def test_parse_grid_rows():
+	from GridLoader import parse_grid_rows
+
+	# Blank lines are skipped and short rows are completed with blank cells
+	assert (parse_grid_rows(b'X,O,\r\n\r\n,X\r\nO', 3) == np.array([[1, -1, 0], [0, 1, 0], [-1, 0, 0]])).all()
+
+	# Rows with more cells than the header and cells with more than one character are invalid
+	with pytest.raises(ValueError):
+		parse_grid_rows(b'X,O,X,O\n', 3)
+	with pytest.raises(ValueError):
+		parse_grid_rows(b'X,OO,X\n', 3)
+
+def test_save_grid(numeric_test_input_data, tmp_path):
+	from GridLoader import load_grid, save_grid
+
+	# Saved as a CSV file of X, O and blank cells the same way the input files are written
+	data_grid, column_names = load_grid('./tests/Input_test_data.csv')
+	save_grid(data_grid, str(tmp_path / 'grid.csv'), column_names)
+	assert pd.read_csv(str(tmp_path / 'grid.csv')).fillna('').equals(pd.read_csv('./tests/Input_test_data.csv').fillna(''))
+
+	save_grid(data_grid, str(tmp_path / 'grid.npy'))
+	assert (np.load(str(tmp_path / 'grid.npy')) == numeric_test_input_data.values).all()
+
+def test_convert_grid_to_char_grid():
+	from GridLoader import load_grid, convert_grid_to_char_grid
+
+	# Converted test data to 6x6 character matrix (1 - X, -1 is O and 0 is blank/empty)
+	data_grid, column_names = load_grid('./tests/Input_test_data.csv')
+	character_seq_test_input_data = pd.read_csv('./tests/Input_test_data.csv').fillna('')
+	assert convert_grid_to_char_grid(data_grid, column_names).equals(character_seq_test_input_data)
+
+def test_convert_csv_to_npy(numeric_test_input_data, tmp_path):
+	from GridLoader import convert_csv_to_npy, open_grid
+
+	# Blocks of 20 bytes hold about one row, so the rows are streamed over several blocks
+	data_grid, column_names = convert_csv_to_npy('./tests/Input_test_data.csv', str(tmp_path / 'grid.npy'), chunk_size=20)
+	assert (data_grid == numeric_test_input_data.values).all()
+	assert column_names == ['Col1', 'Col2', 'Col3', 'Col4', 'Col5', 'Col6']
+
+	# The .npy file is memory-mapped instead of being read into memory
+	data_grid, column_names = open_grid(str(tmp_path / 'grid.npy'), mmap_mode='r')
+	assert isinstance(data_grid, np.memmap)
+	assert (data_grid == numeric_test_input_data.values).all()
+	assert column_names == ['Col1', 'Col2', 'Col3', 'Col4', 'Col5', 'Col6']
+
+	# Values other than 1, -1 and 0 are invalid
+	np.save(str(tmp_path / 'invalid_grid.npy'), np.array([[1, 2], [0, -1]], dtype=np.int8))
+	with pytest.raises(ValueError):
+		open_grid(str(tmp_path / 'invalid_grid.npy'))
+
+	# Values are checked in the dtype of the file, 257 would be 1 once cast to int8
+	np.save(str(tmp_path / 'invalid_grid.npy'), np.array([[1, 257], [0, -1]], dtype=np.int16))
+	with pytest.raises(ValueError):
+		open_grid(str(tmp_path / 'invalid_grid.npy'))